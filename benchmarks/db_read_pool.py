@@ -0,0 +1,76 @@
+# Concurrent AccountsDB lookups next to slow full scans by size of the read-only connection pool.
+# usage: python benchmarks/db_read_pool.py [pool sizes ...]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.utils.accounts_db import AccountsDB  # noqa: E402
+
+ACCOUNTS = 20000
+CONCURRENCY = 64  # accounts reading their proxies
+SCANNERS = (0, 4)  # accounts scanning all proxies at the same time
+DURATION = 3
+
+
+async def fill(path: str):
+    db = AccountsDB(path)
+    await db.connect()
+    await db.executemany("INSERT INTO Accounts(email, proxies) VALUES(?, ?)",
+                         [(f"account{i}@example.com", f"http://10.0.{i // 256 % 256}.{i % 256}:8080")
+                          for i in range(ACCOUNTS)])
+    await db.close_connection()
+
+
+async def scanner(db: AccountsDB, deadline: float):
+    # the slow full scan of proxies_exist, run by accounts looking for spare proxies
+    while time.perf_counter() < deadline:
+        await db.proxies_exist("http://10.255.255.255:8080")
+
+
+async def reader(db: AccountsDB, deadline: float, i: int, latencies: list) -> int:
+    done = 0
+    while time.perf_counter() < deadline:
+        started_at = time.perf_counter()
+        await db.get_proxies_by_email(f"account{(i * 7919 + done) % ACCOUNTS}@example.com")
+        latencies.append(time.perf_counter() - started_at)
+        done += 1
+    return done
+
+
+async def measure(path: str, pool_size: int, scanners: int) -> tuple:
+    db = AccountsDB(path)
+    await db.connect()
+    await db.close_readers()
+    await db.open_readers(pool_size)
+
+    deadline = time.perf_counter() + DURATION
+    latencies = []
+    done = await asyncio.gather(*(reader(db, deadline, i, latencies) for i in range(CONCURRENCY)),
+                                *(scanner(db, deadline) for _ in range(scanners)))
+
+    await db.close_connection()
+    latencies.sort()
+    return sum(done[:CONCURRENCY]) / DURATION, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.db")
+        await fill(path)
+
+        for scanners in SCANNERS:
+            print(f"{CONCURRENCY} accounts reading their proxies, {scanners} scanning all proxies, "
+                  f"{os.cpu_count()} CPUs")
+
+            for pool_size in map(int, sys.argv[1:] or (0, 1, 2, 4, 8)):
+                label = "writer only" if not pool_size else f"{pool_size} readers"
+                rate, p50, p95 = await measure(path, pool_size, scanners)
+                print(f"{label:>11} | {rate:>7.0f} lookups/s | p50 {p50 * 1000:>6.1f} ms | p95 {p95 * 1000:>6.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
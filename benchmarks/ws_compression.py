@@ -0,0 +1,82 @@
+# CPU cost vs bytes saved of permessage-deflate for typical websocket frames, aiohttp deflates every frame
+# once the extension is negotiated.
+# usage: python benchmarks/ws_compression.py
+import base64
+import json
+import os
+import random
+import time
+import uuid
+import zlib
+
+ROUNDS = 200
+
+
+def ping_frame() -> str:
+    return json.dumps({"id": str(uuid.uuid4()), "version": "1.0.0", "action": "PING", "data": {}})
+
+
+def pong_frame() -> str:
+    return json.dumps({"id": str(uuid.uuid4()), "origin_action": "PONG"})
+
+
+def http_response_frame(size: int) -> str:
+    # HTTP_REQUEST results carry a base64 page body, html is repetitive, random bytes model binary content
+    words = ["<div class=\"item\">", "</div>", "<a href=\"/page\">", "</a>", "<span>", "</span>", "text", "\n"]
+    html = "".join(random.choice(words) for _ in range(size // 6)).encode()[:size // 2]
+    body = html + os.urandom(size // 2)
+
+    return json.dumps({
+        "id": str(uuid.uuid4()),
+        "origin_action": "HTTP_REQUEST",
+        "result": {
+            "url": "https://example.com/page",
+            "status": 200,
+            "status_text": "OK",
+            "headers": {"content-type": "text/html; charset=utf-8"},
+            "body": base64.b64encode(body).decode()
+        }
+    })
+
+
+def deflate(data: bytes) -> int:
+    # same settings aiohttp uses for a per-frame compressor
+    compressor = zlib.compressobj(level=zlib.Z_BEST_SPEED, wbits=-15)
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def run(frames: list) -> tuple:
+    raw = sent = 0
+    started_at = time.process_time()
+
+    for _ in range(ROUNDS):
+        for frame in frames:
+            data = frame.encode()
+            raw += len(data)
+            sent += deflate(data)
+
+    return raw, sent, time.process_time() - started_at
+
+
+def main():
+    random.seed(0)
+    # a connection mostly sends PINGs and PONGs, jobs are rarer but much larger
+    kinds = {
+        "ping": [ping_frame() for _ in range(20)],
+        "pong": [pong_frame() for _ in range(20)],
+        "job 2 KB": [http_response_frame(2_000)],
+        "job 20 KB": [http_response_frame(20_000)],
+        "job 200 KB": [http_response_frame(200_000)],
+    }
+
+    print(f"{'frames':>10} | {'raw KB':>10} | {'sent KB':>10} | {'saved':>6} | {'cpu ms':>8} | {'us/KB saved':>11}")
+    for kind, frames in kinds.items():
+        raw, sent, cpu = run(frames)
+        saved = raw - sent
+        per_kb = cpu * 1e6 / (saved / 1024) if saved > 0 else 0
+        print(f"{kind:>10} | {raw / 1024:>10.0f} | {sent / 1024:>10.0f} | {saved / raw:>6.1%} | "
+              f"{cpu * 1000:>8.1f} | {per_kb:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,3 @@
 from .grass import Grass
+from .multi_grass import MultiGrass
 
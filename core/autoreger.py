@@ -1,23 +1,33 @@
 import random
 import traceback
-from asyncio import Semaphore, sleep, create_task, wait
+from asyncio import Semaphore, Event, create_task, wait, FIRST_COMPLETED
 from itertools import zip_longest
 
-from core.utils import logger, file_to_list, str_to_file
+from core.utils import logger, file_to_list, str_to_file, clock
 
 
 class AutoReger:
-    def __init__(self, accounts: list):
+    def __init__(self, accounts: list, persistent: bool = False):
         self.accounts = accounts
+        self.persistent = persistent  # keeps running without accounts, waiting for spawned ones (node mode)
+        self.spawned = Event()
 
         self.success = 0
         self.semaphore = None
         self.delay = None
+        self.worker_func = None
+        self.tasks = {}
 
     @classmethod
     def get_accounts(cls, file_names: tuple, amount: int = None, auto_creation: tuple = None, with_id: bool = False,
                      static_extra: tuple = None):
         consumables = [file_to_list(file_name) for file_name in file_names]
+        return cls.from_lists(consumables, amount, auto_creation, with_id, static_extra)
+
+    @classmethod
+    def from_lists(cls, consumables: list, amount: int = None, auto_creation: tuple = None, with_id: bool = False,
+                   static_extra: tuple = None):
+        consumables = list(consumables)
 
         if amount and consumables[0]:
             consumables = [consumable[:amount] for consumable in consumables]
@@ -54,7 +64,46 @@ class AutoReger:
                    else "No accounts handled :( | Check logs in logs/out.log")
 
     async def define_tasks(self, worker_func: callable):
-        await wait([create_task(self.worker(account, worker_func)) for account in self.accounts])
+        self.worker_func = worker_func
+        for account in self.accounts:
+            self.spawn(account)
+
+        # accounts may be spawned while running (hot reload), so wait until none is left
+        while self.tasks or self.persistent:
+            self.spawned.clear()
+            if self.tasks:
+                await wait(list(self.tasks.values()), return_when=FIRST_COMPLETED)
+            else:
+                await self.spawned.wait()
+
+    def spawn(self, account: tuple, with_slot: bool = False):
+        # with_slot - the account brings its own semaphore slot instead of queueing for a busy one
+        if with_slot:
+            self.semaphore.release()
+        if account not in self.accounts:
+            self.accounts.append(account)
+
+        account_id = account[0]
+        task = self.tasks[account_id] = create_task(self.worker(account, self.worker_func))
+        task.add_done_callback(lambda _: self.tasks.pop(account_id, None))
+        self.spawned.set()
+
+    async def stop(self, timeout: float):
+        # cancels every worker, their cleanup runs in parallel; returns how many didn't finish in time
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+
+        if not tasks:
+            return 0
+
+        _, pending = await wait(tasks, timeout=timeout)
+        return len(pending)
+
+    async def retire(self, account_id):
+        if task := self.tasks.get(account_id):
+            task.cancel()
+            await wait([task])
 
     async def worker(self, account: tuple, worker_func: callable):
         account_id = account[0][:15] if isinstance(account, str) else account[0]
@@ -75,7 +124,7 @@ class AutoReger:
         if self.delay[1] > 0:
             sleep_time = random.uniform(*self.delay)
             logger.info(f"Sleep for {sleep_time:.1f} seconds")
-            await sleep(sleep_time)
+            await clock.sleep(sleep_time)
 
     @staticmethod
     def logs(account_id: str, account: tuple, is_success: bool = False):
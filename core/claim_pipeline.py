@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+from typing import List, Optional
+
+import aiohttp
+from fake_useragent import UserAgent
+from tenacity import retry, retry_if_exception_type
+
+from .autoreger import AutoReger
+from .grass_sdk.website import GrassRest
+from .utils import logger, file_to_list, str_to_file
+from .utils.accounts_db import AccountsDB
+from .utils.backoff import backoff
+from .utils.exception import LoginException, ProxyBlockedException, TokenExpiredException
+from .utils.rate_limiter import RateLimiter
+from data.config import CLAIM_CONCURRENCY, CLAIM_LOGIN_RATE, CLAIM_TOKEN_TTL, CLAIM_PROGRESS_INTERVAL, \
+    CLAIM_CHECKPOINT_PATH
+
+TIERS_AMOUNT = 8
+
+
+@retry(**backoff("claim").retry_kwargs(), retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError)),
+       reraise=True)
+async def claim_next_reward(client: GrassRest) -> bool:
+    return await client.claim_next_reward()
+
+
+class ClaimPipeline:
+    # accounts flow through a queue to CLAIM_CONCURRENCY workers: cached token or rate limited login,
+    # then tiers are claimed until the api refuses one. Finished emails go to a checkpoint file
+
+    def __init__(self, accounts: List[str], proxies: List[str], db: AccountsDB):
+        self.accounts = accounts
+        self.proxies = proxies
+        self.db = db
+
+        self.login_limiter = RateLimiter(CLAIM_LOGIN_RATE)
+        self.ua = UserAgent(platforms=['desktop'])
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+        self.done = set(file_to_list(CLAIM_CHECKPOINT_PATH)) if os.path.exists(CLAIM_CHECKPOINT_PATH) else set()
+        self.total = 0
+        self.finished = 0
+        self.success = 0
+        self.claimed = 0
+        self.started_at = time.monotonic()
+        self.reported_at = 0.0
+
+    async def run(self):
+        for _id, account in enumerate(self.accounts, 1):
+            if account.split(":")[0] not in self.done:
+                self.queue.put_nowait((_id, account, self.proxies[_id - 1] if len(self.proxies) >= _id else None))
+
+        self.total = self.queue.qsize()
+        logger.info(f"Claiming rewards of {self.total} accounts, {len(self.accounts) - self.total} "
+                    f"already done by previous runs ({CLAIM_CHECKPOINT_PATH})")
+
+        self.session = aiohttp.ClientSession(trust_env=True, connector=aiohttp.TCPConnector(
+            ssl=False, limit=CLAIM_CONCURRENCY * 2))
+
+        try:
+            await asyncio.gather(*(self.worker() for _ in range(min(CLAIM_CONCURRENCY, self.total))))
+        finally:
+            await self.session.close()
+
+        self.report_progress(force=True)
+        (logger.success if self.success else logger.warning)(
+            f"Claimed {self.claimed} tiers, {self.success}/{self.total} accounts handled")
+
+    async def worker(self):
+        while not self.queue.empty():
+            _id, account, proxy = self.queue.get_nowait()
+            is_success = False
+
+            try:
+                is_success = await self.claim_account(_id, account, proxy)
+            except (LoginException, ProxyBlockedException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"{_id} | Claim failed: {e}")
+            except Exception as e:
+                logger.error(f"{_id} | Claim not handled exception | error: {e}")
+
+            self.finished += 1
+            self.success += int(is_success)
+            AutoReger.logs(_id, (_id, account), is_success)
+            self.report_progress()
+
+    async def claim_account(self, _id: int, account: str, proxy: Optional[str]) -> bool:
+        email, password = account.split(":")[:2]
+
+        client = GrassRest(email=email, password=password, user_agent=str(self.ua.random), proxy=proxy)
+        client.id = _id
+        client.session = self.session
+
+        is_cached = await self.authorize(client)
+
+        try:
+            claimed = await self.claim_tiers(client)
+        except TokenExpiredException:
+            if not is_cached:
+                raise
+            await self.db.delete_token(email)
+            await self.authorize(client)
+            claimed = await self.claim_tiers(client)
+
+        self.claimed += claimed
+        self.done.add(email)
+        str_to_file(CLAIM_CHECKPOINT_PATH, email)
+
+        logger.info(f"{_id} | {email} | Claimed {claimed} tiers")
+        return True
+
+    async def authorize(self, client: GrassRest) -> bool:
+        # returns True if a cached token was used
+        if CLAIM_TOKEN_TTL and (cached := await self.db.get_token(client.email, CLAIM_TOKEN_TTL)):
+            client.access_token = cached[1]
+            return True
+
+        await self.login_limiter.acquire()
+        user_id = await client.enter_account()
+        await self.db.set_token(client.email, user_id, client.access_token)
+        return False
+
+    async def claim_tiers(self, client: GrassRest) -> int:
+        # tiers are claimed in order, the first refused one means the rest are claimed or not reached
+        for claimed in range(TIERS_AMOUNT):
+            if not await claim_next_reward(client):
+                return claimed
+
+        return TIERS_AMOUNT
+
+    def report_progress(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.reported_at < CLAIM_PROGRESS_INTERVAL:
+            return
+        self.reported_at = now
+
+        rate = self.finished / max(now - self.started_at, 1e-9)
+        eta = (self.total - self.finished) / rate if rate else 0
+        logger.info(f"Claim progress: {self.finished}/{self.total} | {rate * 60:.1f} accounts/min | "
+                    f"ETA {int(eta // 3600)}h {int(eta % 3600 // 60)}m")
@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import List, Optional
+
+import aiosqlite
+from aiohttp import web
+from better_proxy import Proxy
+
+from .farm_reloader import FarmReloader
+from .utils import logger, file_to_list
+from data.config import ACCOUNTS_FILE_PATH, PROXIES_FILE_PATH, COORDINATOR_HOST, COORDINATOR_PORT, \
+    COORDINATOR_DB_PATH, COORDINATOR_TOKEN, LEASE_TTL, HOT_RELOAD_INTERVAL
+
+
+class Coordinator:
+    # hands out time-limited leases on accounts (all lines of one email) and spare proxies to farm nodes.
+    # A heartbeat renews every lease of the node, leases of a silent node expire and go to the next node asking
+
+    def __init__(self, db_path: str = COORDINATOR_DB_PATH, lease_ttl: float = LEASE_TTL, token: str = COORDINATOR_TOKEN):
+        self.db_path = db_path
+        self.lease_ttl = lease_ttl
+        self.token = token
+
+        self.connection: Optional[aiosqlite.Connection] = None
+        self.lock = asyncio.Lock()
+        self.mtimes = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self.connection = await aiosqlite.connect(self.db_path)
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        await self.connection.execute('''
+        CREATE TABLE IF NOT EXISTS Leases (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            node TEXT,
+            expires_at REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+        ''')
+        await self.connection.execute("CREATE INDEX IF NOT EXISTS idx_leases_node ON Leases(node)")
+        await self.connection.commit()
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+        await self.connection.close()
+
+    async def load(self, accounts: List[str], proxies: List[str]):
+        # line i of accounts runs on proxy i like on a single host, the rest of the proxies are spares.
+        # Leases of items still listed are kept, so an edit or a restart doesn't move running accounts
+        items = {}
+        for i, line in enumerate(accounts):
+            items.setdefault(("account", line.split(":")[0]), []).append(
+                {"line": line, "proxy": proxies[i] if i < len(proxies) else None})
+        for proxy in proxies[len(accounts):]:
+            items[("spare", proxy)] = proxy
+
+        async with self.lock:
+            async with self.connection.execute("SELECT kind, key FROM Leases") as cursor:
+                removed = [row for row in await cursor.fetchall() if row not in items]
+
+            await self.connection.executemany("DELETE FROM Leases WHERE kind = ? AND key = ?", removed)
+            await self.connection.executemany(
+                "INSERT INTO Leases(kind, key, payload) VALUES(?, ?, ?) "
+                "ON CONFLICT(kind, key) DO UPDATE SET payload = excluded.payload",
+                [(kind, key, json.dumps(payload)) for (kind, key), payload in items.items()]
+            )
+            await self.connection.commit()
+
+        logger.info(f"Coordinator | {sum(kind == 'account' for kind, _ in items)} accounts and "
+                    f"{sum(kind == 'spare' for kind, _ in items)} spare proxies to lease, {len(removed)} removed")
+
+    async def load_files(self):
+        accounts = file_to_list(ACCOUNTS_FILE_PATH)
+        proxies = [Proxy.from_str(proxy).as_url for proxy in file_to_list(PROXIES_FILE_PATH)]
+        await self.load(accounts, proxies)
+
+    async def watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+
+            if (mtimes := FarmReloader.get_mtimes()) == self.mtimes:
+                continue
+
+            try:
+                await self.load_files()
+                # a failed reload is retried next time, not only after the files change again
+                self.mtimes = mtimes
+            except Exception as e:
+                logger.error(f"Coordinator | Reload failed: {e}")
+
+    async def heartbeat(self, node: str, capacity: int = 0, spares: int = 0) -> dict:
+        # renews the leases of the node, then tops it up to `capacity` accounts (0 - every free one)
+        # and grants `spares` more spare proxies. Expired leases of other nodes count as free
+        now = time.time()
+
+        async with self.lock:
+            await self.connection.execute("UPDATE Leases SET expires_at = ? WHERE node = ?",
+                                          (now + self.lease_ttl, node))
+
+            async with self.connection.execute("SELECT COUNT(*) FROM Leases WHERE kind = 'account' AND node = ?",
+                                               (node,)) as cursor:
+                held = (await cursor.fetchone())[0]
+
+            # a node over its capacity (restarted with a lower one) keeps its leases but gets no more
+            wanted = {"account": max(capacity - held, 0) if capacity else None, "spare": max(spares, 0)}
+            for kind, amount in wanted.items():
+                if amount != 0:
+                    await self.grant(node, kind, amount, now)
+
+            async with self.connection.execute("SELECT kind, payload FROM Leases WHERE node = ? ORDER BY kind, key",
+                                               (node,)) as cursor:
+                rows = await cursor.fetchall()
+            await self.connection.commit()
+
+        return {
+            "accounts": [entry for kind, payload in rows if kind == "account" for entry in json.loads(payload)],
+            "spares": [json.loads(payload) for kind, payload in rows if kind == "spare"],
+            "ttl": self.lease_ttl,
+        }
+
+    async def grant(self, node: str, kind: str, amount: Optional[int], now: float):
+        # amount None - every free item
+        query = "SELECT key, node FROM Leases WHERE kind = ? AND (node IS NULL OR expires_at < ?) ORDER BY key"
+        params = (kind, now)
+        if amount is not None:
+            query += " LIMIT ?"
+            params += (amount,)
+
+        async with self.connection.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+
+        await self.connection.executemany("UPDATE Leases SET node = ?, expires_at = ? WHERE kind = ? AND key = ?",
+                                          [(node, now + self.lease_ttl, kind, key) for key, _ in rows])
+
+        for dead_node, amount in Counter(previous for _, previous in rows if previous).items():
+            logger.warning(f"Coordinator | {amount} {kind} leases of {dead_node} expired, moved to {node}")
+        if rows:
+            logger.info(f"Coordinator | {node} leased {len(rows)} more {kind} items")
+
+    async def release(self, node: str):
+        async with self.lock:
+            await self.connection.execute("UPDATE Leases SET node = NULL, expires_at = 0 WHERE node = ?", (node,))
+            await self.connection.commit()
+        logger.info(f"Coordinator | {node} released its leases")
+
+    async def status(self) -> dict:
+        now = time.time()
+        nodes = {}
+
+        async with self.connection.execute(
+                "SELECT node, kind, COUNT(*), MIN(expires_at) FROM Leases GROUP BY node, kind") as cursor:
+            for node, kind, amount, expires_at in await cursor.fetchall():
+                if node is None or expires_at < now:
+                    nodes.setdefault("free", {})[kind] = nodes.get("free", {}).get(kind, 0) + amount
+                else:
+                    nodes.setdefault(node, {})[kind] = amount
+
+        return nodes
+
+    @web.middleware
+    async def check_token(self, request: web.Request, handler):
+        if self.token and request.headers.get("Authorization") != f"Bearer {self.token}":
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    async def handle_heartbeat(self, request: web.Request):
+        data = await request.json()
+        return web.json_response(await self.heartbeat(data["node"], int(data.get("capacity", 0)),
+                                                      int(data.get("spares", 0))))
+
+    async def handle_release(self, request: web.Request):
+        await self.release((await request.json())["node"])
+        return web.json_response({})
+
+    async def handle_status(self, request: web.Request):
+        return web.json_response(await self.status())
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.check_token])
+        app.add_routes([
+            web.post("/heartbeat", self.handle_heartbeat),
+            web.post("/release", self.handle_release),
+            web.get("/status", self.handle_status),
+        ])
+        return app
+
+    async def serve(self, host: str, port: int):
+        await self.connect()
+        await self.load_files()
+        self.mtimes = FarmReloader.get_mtimes()
+        self.task = asyncio.create_task(self.watch(HOT_RELOAD_INTERVAL or 30))
+
+        runner = web.AppRunner(self.create_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Coordinator | Listening on http://{host}:{port}, lease ttl {self.lease_ttl}s")
+
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            await self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lease accounts and spare proxies to farm nodes")
+    parser.add_argument("--host", default=COORDINATOR_HOST)
+    parser.add_argument("--port", type=int, default=COORDINATOR_PORT)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(Coordinator().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from typing import List
+
+import aiohttp
+
+from .autoreger import AutoReger
+from .farm_reloader import FarmReloader, group_accounts
+from .utils import logger
+from .utils.accounts_db import AccountsDB
+from .utils.session import get_shared_session
+from data.config import COORDINATOR_TOKEN, NODE_CAPACITY, NODE_SPARE_PROXIES, NODE_HEARTBEAT_INTERVAL
+
+HEARTBEAT_TIMEOUT = 15  # seconds
+
+
+class FarmNode(FarmReloader):
+    # node mode: accounts and spare proxies are leased from the coordinator instead of read from local files.
+    # Every heartbeat renews the leases and the farm is synced to them the way a hot reload applies a file diff
+
+    def __init__(self, autoreger: AutoReger, db: AccountsDB, url: str, node_id: str, multi: bool,
+                 capacity: int = NODE_CAPACITY, spares: int = NODE_SPARE_PROXIES,
+                 interval: float = NODE_HEARTBEAT_INTERVAL, token: str = COORDINATOR_TOKEN):
+        super().__init__(autoreger, db, [], [], multi, interval)
+        self.url = url.rstrip("/")
+        self.node_id = node_id
+        self.capacity = capacity
+        self.spares = spares
+        self.token = token
+        self.leased_until = 0.0
+
+    async def watch(self):
+        while True:
+            try:
+                await self.reload()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+                logger.warning(f"Coordinator {self.url} unreachable: {e}")
+            except Exception as e:
+                logger.error(f"Node sync failed: {e}")
+
+            # the next heartbeat may come too late to renew the leases, they are given up while still ours:
+            # after they expire the accounts may run on another node, running them here too would double them
+            if self.running and time.time() > self.leased_until - self.interval - HEARTBEAT_TIMEOUT:
+                logger.warning("Leases expire before the next heartbeat, stopping all accounts "
+                               "until the coordinator is back")
+                try:
+                    await self.sync([], [])
+                except Exception as e:
+                    logger.error(f"Node sync failed: {e}")
+
+            await asyncio.sleep(self.interval)
+
+    async def request(self, path: str, payload: dict) -> dict:
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+        async with get_shared_session().post(f"{self.url}{path}", json=payload, headers=headers,
+                                             timeout=aiohttp.ClientTimeout(total=HEARTBEAT_TIMEOUT)) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def reload(self):
+        sent_at = time.time()
+        leases = await self.request("/heartbeat", {
+            "node": self.node_id,
+            "capacity": self.capacity,
+            "spares": max(self.spares - await self.db.count_extra_proxies(), 0),
+        })
+
+        self.leased_until = sent_at + leases["ttl"]
+        await self.sync(leases["accounts"], leases["spares"])
+
+    async def sync(self, entries: List[dict], spares: List[str]):
+        accounts = [entry["line"] for entry in entries]
+        proxies = [entry["proxy"] for entry in entries]
+        groups = group_accounts(accounts, self.multi)
+
+        # only leased spares go back to the local spares, proxies of a lost account belong to its new node
+        removed = [key for key, (_, line, connections) in self.running.items()
+                   if key not in groups or groups[key][0] != line or groups[key][2] != connections]
+        for key in removed:
+            await self.retire(key, spares)
+
+        new_spares = [proxy for proxy in spares if proxy not in self.proxies]
+        # spares no longer leased may belong to another node by now, the unused ones leave the local spares
+        lost_spares = self.proxies - set(spares)
+        self.proxies = set(spares)
+        if lost_spares:
+            await self.db.delete_extra_proxies(lost_spares)
+        if new_spares:
+            await self.db.push_extra_proxies(new_spares)
+
+        added = [key for key in groups if key not in self.running]
+        added_emails = {groups[key][0].split(":")[0] for key in added}
+
+        # every line brings its proxy to the account, as on a single host start
+        for line, proxy in zip(accounts, proxies):
+            email = line.split(":")[0]
+            if proxy and email in added_emails and not await self.db.proxies_exist(proxy):
+                await self.db.add_account(email, proxy)
+
+        for key in added:
+            line, index, connections = groups[key]
+            await self.spawn(key, line, connections, proxies[index])
+
+        if removed or added or new_spares or lost_spares:
+            logger.info(f"Node {self.node_id}: {len(added)} accounts started, {len(removed)} stopped, "
+                        f"{len(new_spares)} new spare proxies, {len(lost_spares)} lost")
+
+    async def release(self):
+        # lets other nodes take the accounts right away instead of after the lease ttl
+        try:
+            await self.request("/release", {"node": self.node_id})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            expires_in = max(self.leased_until - time.time(), 0)
+            logger.warning(f"Can't release leases, they expire in {expires_in:.0f}s: {e}")
@@ -0,0 +1,143 @@
+import asyncio
+import os
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from better_proxy import Proxy
+
+from .autoreger import AutoReger
+from .utils import logger, file_to_list
+from .utils.accounts_db import AccountsDB
+from .utils.proxy_probe import rank_proxies
+from data.config import ACCOUNTS_FILE_PATH, PROXIES_FILE_PATH, PROBE_PROXIES_ON_START
+
+
+def group_accounts(accounts: List[str], multi: bool) -> Dict[tuple, Tuple[str, int, int]]:
+    # key -> (first line, index of the first line, connections)
+    # multi mode: one key per email, otherwise one per line (repeated lines are told apart by occurrence)
+    groups = {}
+    occurrences = Counter()
+
+    for i, account in enumerate(accounts):
+        if multi:
+            key = (account.split(":")[0],)
+        else:
+            occurrences[account] += 1
+            key = (account, occurrences[account])
+
+        if key in groups:
+            line, index, connections = groups[key]
+            groups[key] = (line, index, connections + 1)
+        else:
+            groups[key] = (account, i, 1)
+
+    return groups
+
+
+class FarmReloader:
+    # watches accounts/proxies files and applies the diff to the running farm:
+    # new accounts get workers, removed ones are retired, new proxies become spares. Healthy connections stay as is
+
+    def __init__(self, autoreger: AutoReger, db: AccountsDB, accounts: List[str], proxies: List[str],
+                 multi: bool, interval: float):
+        self.autoreger = autoreger
+        self.db = db
+        self.multi = multi
+        self.interval = interval
+
+        self.proxies = set(proxies)
+        # key -> (account id, line, connections), ids match AutoReger.from_lists numbering
+        self.running: Dict[tuple, tuple] = {
+            key: (_id, line, connections)
+            for _id, (key, (line, _, connections)) in enumerate(group_accounts(accounts, multi).items(), 1)
+        }
+        self.next_id = len(autoreger.accounts) + 1
+        self.mtimes = self.get_mtimes()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.watch())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    @staticmethod
+    def get_mtimes() -> tuple:
+        return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None
+                     for path in (ACCOUNTS_FILE_PATH, PROXIES_FILE_PATH))
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            if (mtimes := self.get_mtimes()) == self.mtimes:
+                continue
+
+            try:
+                await self.reload()
+                # a failed reload is retried next time, not only after the files change again
+                self.mtimes = mtimes
+            except Exception as e:
+                logger.error(f"Hot reload failed: {e}")
+
+    async def reload(self):
+        accounts = file_to_list(ACCOUNTS_FILE_PATH)
+        proxies = [Proxy.from_str(proxy).as_url for proxy in file_to_list(PROXIES_FILE_PATH)]
+        await self.apply(accounts, proxies)
+
+    async def apply(self, accounts: List[str], proxies: List[str]):
+        groups = group_accounts(accounts, self.multi)
+
+        # an account whose amount of connections changed is restarted with the new amount
+        removed = [key for key, (_, line, connections) in self.running.items()
+                   if key not in groups or groups[key][0] != line or groups[key][2] != connections]
+        for key in removed:
+            await self.retire(key, proxies)
+
+        new_proxies = [proxy for proxy in dict.fromkeys(proxies) if proxy not in self.proxies]
+        self.proxies = set(proxies)
+        if PROBE_PROXIES_ON_START and new_proxies:
+            new_proxies = await rank_proxies(new_proxies, self.db)
+
+        added = [key for key in groups if key not in self.running]
+        for key in added:
+            line, _, connections = groups[key]
+            await self.spawn(key, line, connections, new_proxies.pop(0) if new_proxies else None)
+
+        if new_proxies:
+            await self.db.push_extra_proxies(new_proxies)
+
+        if removed or added or new_proxies:
+            logger.info(f"Hot reload: {len(added)} accounts started, {len(removed)} retired, "
+                        f"{len(new_proxies)} new spare proxies")
+
+    async def retire(self, key: tuple, proxies: List[str]):
+        _id, line, _ = self.running.pop(key)
+        email = line.split(":")[0]
+
+        logger.info(f"{_id} | {email} | Removed from accounts, stopping...")
+        await self.autoreger.retire(_id)
+
+        # proxies go back to the spares unless another worker of the same email still runs on them
+        if not any(other.split(":")[0] == email for _, other, _ in self.running.values()):
+            released = [proxy for proxy in await self.db.remove_account(email) if proxy in proxies]
+            if released:
+                await self.db.push_extra_proxies(released)
+
+    async def spawn(self, key: tuple, line: str, connections: int, proxy: Optional[str]):
+        email = line.split(":")[0]
+
+        # an account without a new proxy of its own claims a spare one
+        if proxy is None:
+            proxy = await self.db.get_new_from_extra_proxies("ProxyList")
+
+        if proxy and not await self.db.proxies_exist(proxy):
+            await self.db.add_account(email, proxy)
+
+        _id, self.next_id = self.next_id, self.next_id + 1
+        self.running[key] = (_id, line, connections)
+
+        account = (_id, line, proxy, connections, self.db) if self.multi else (_id, line, proxy, self.db)
+        logger.info(f"{_id} | {email} | Added to accounts, starting...")
+        self.autoreger.spawn(account, with_slot=True)
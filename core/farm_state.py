@@ -0,0 +1,84 @@
+import json
+import os
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from .utils import logger
+
+
+class FarmState:
+    # per-account state of running clients, saved on shutdown and restored by a --resume start
+
+    def __init__(self):
+        self.clients: Dict[str, object] = {}
+        self.restored: Dict[str, List[dict]] = {}
+
+    def register(self, client):
+        self.clients[str(client.id)] = client
+
+    def unregister(self, client):
+        self.clients.pop(str(client.id), None)
+
+    def snapshot(self) -> dict:
+        return {
+            "saved_at": time.time(),
+            "accounts": [{"email": client.email, **client.snapshot()} for client in self.clients.values()]
+        }
+
+    def save(self, path: str):
+        snapshot = self.snapshot()
+
+        # written aside and swapped in, so an interrupted save never leaves a broken snapshot
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.tmp", path)
+
+        logger.info(f"Saved state of {len(snapshot['accounts'])} accounts to {path}")
+
+    def load(self, path: str) -> bool:
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Can't resume, no valid state snapshot in {path}: {e}")
+            return False
+
+        self.restored.clear()
+        for state in snapshot.get("accounts", []):
+            self.restored.setdefault(state["email"], []).append(state)
+
+        logger.info(f"Resuming {len(snapshot.get('accounts', []))} accounts from a snapshot of "
+                    f"{int(time.time() - snapshot.get('saved_at', 0)) // 60} minutes ago")
+        return True
+
+    def pop(self, email: str) -> Optional[dict]:
+        if states := self.restored.get(email):
+            return states.pop(0)
+
+    def arrange_proxies(self, accounts: List[str], proxies: List[str]) -> List[str]:
+        # every account line gets back the proxy it ran on if that proxy is still listed, the rest fill the gaps
+        snapshot_proxies = {email: [proxy for state in states for proxy in state.get("proxies", [])]
+                            for email, states in self.restored.items()}
+        listed = set(proxies)
+        taken = set()
+        slots = []
+        seen = Counter()
+
+        for account in accounts[:len(proxies)]:
+            email = account.split(":")[0]
+            previous = snapshot_proxies.get(email, [])
+            proxy = previous[seen[email]] if seen[email] < len(previous) else None
+            seen[email] += 1
+
+            if proxy in listed and proxy not in taken:
+                taken.add(proxy)
+                slots.append(proxy)
+            else:
+                slots.append(None)
+
+        rest = iter([proxy for proxy in proxies if proxy not in taken])
+        return [proxy or next(rest) for proxy in slots] + list(rest)
+
+
+farm_state = FarmState()
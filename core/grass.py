@@ -1,64 +1,117 @@
 import asyncio
 import random
 import uuid
-from typing import List, Optional
+from typing import Optional
 
 import aiohttp
 from fake_useragent import UserAgent
-from tenacity import stop_after_attempt, retry, retry_if_not_exception_type, wait_random, retry_if_exception_type
+from tenacity import retry, retry_if_not_exception_type, retry_if_exception_type
 
-from data.config import MIN_PROXY_SCORE, CHECK_POINTS, STOP_ACCOUNTS_WHEN_SITE_IS_DOWN, NODE_TYPE
+from data.config import MIN_PROXY_SCORE, CHECK_POINTS, STOP_ACCOUNTS_WHEN_SITE_IS_DOWN, NODE_TYPE, \
+    PROXY_SCORE_CACHE_TTL, WARM_STANDBY, WARM_STANDBY_CHECKIN_TTL, WS_STALE_AFTER
 
 try:
     from data.config import SHOW_LOGS_RARELY
 except ImportError:
     SHOW_LOGS_RARELY = ""
 
+from .points_poller import points_poller
+from .ws_sweeper import ws_sweeper
 from .grass_sdk.extension import GrassWs
 from .grass_sdk.website import GrassRest
-from .utils import logger
+from .utils import logger, clock
 
 from .utils.accounts_db import AccountsDB
+from .utils.backoff import backoff
+from .utils.circuit_breaker import CircuitBreaker, circuit_breakers
 from .utils.error_helper import raise_error, FailureCounter
-from .utils.exception import WebsocketClosedException, LowProxyScoreException, ProxyScoreNotFoundException, \
+from .utils.metrics import metrics
+from .utils.proxy_allocator import proxy_allocator
+from .utils.proxy_ring import ProxyRing, get_proxy_health
+from .utils.session import get_shared_session
+from .utils.exception import WebsocketClosedException, WebsocketStaleException, LowProxyScoreException, ProxyScoreNotFoundException, \
     ProxyForbiddenException, ProxyError, WebsocketConnectionFailedError, FailureLimitReachedException, \
-    NoProxiesException, ProxyBlockedException, SiteIsDownException, LoginException
+    NoProxiesException, ProxyBlockedException, LoginException, TokenExpiredException
 from better_proxy import Proxy
 
 
 class Grass(GrassWs, GrassRest, FailureCounter):
     # global_fail_counter = 0
 
+    # GrassRest/BaseClient slots hold the rest, GrassWs and FailureCounter have none of their own
+    __slots__ = (
+        # GrassWs
+        "destination", "token", "websocket", "last_live_timestamp",
+        "ws_compress", "ws_compressed_frames", "ws_compression_ratio", "ws_bytes_saved", "jobs",
+        # FailureCounter
+        "fail_count", "limit", "limit_reached_count",
+        # Grass
+        "proxy_score", "db", "account", "proxies", "is_extra_proxies_left", "extra_proxies_seen",
+        "reconnect_attempt", "standby_proxy", "standby_checkin", "standby_task", "is_checkin_ready",
+        "failover_started_at", "is_site_probe", "user_id", "restored_user_id",
+    )
+
     def __init__(self, _id: int, email: str, password: str, proxy: str = None, db: AccountsDB = None,
-                 user_agent: str = None):
-        self.proxy = Proxy.from_str(proxy).as_url if proxy else None
-        super(GrassWs, self).__init__(email=email, password=password,
-                                      user_agent=user_agent or str(UserAgent(platforms=['desktop']).random),
-                                      proxy=self.proxy)
+                 user_agent: str = None, account=None):
+        proxy = Proxy.from_str(proxy).as_url if proxy else None
+        user_agent = user_agent or str(UserAgent(platforms=['desktop']).random)
+
+        GrassWs.__init__(self, user_agent=user_agent, proxy=proxy)
+        super(GrassWs, self).__init__(email=email, password=password, user_agent=user_agent, proxy=proxy)
         self.proxy_score: Optional[int] = None
         self.id: int = _id
 
         self.db: AccountsDB = db
 
-        self.session: aiohttp.ClientSession = aiohttp.ClientSession(trust_env=True,
-                                                                    connector=aiohttp.TCPConnector(ssl=False))
-
-        self.proxies: List[str] = []
+        # connections of a MultiGrass account share its login and proxies
+        self.account = account
+        self.session: aiohttp.ClientSession = get_shared_session()
+        self.proxies: ProxyRing = account.proxies if account else ProxyRing()
         self.is_extra_proxies_left: bool = True
+        self.extra_proxies_seen: int = 0
 
         self.fail_count = 0
         self.limit = 7
+        self.limit_reached_count = 0
+        self.reconnect_attempt = 0
+
+        self.standby_proxy: Optional[str] = None
+        self.standby_checkin: Optional[tuple] = None
+        self.standby_task: Optional[asyncio.Task] = None
+        self.is_checkin_ready: bool = False
+        self.failover_started_at: Optional[float] = None
+        self.is_site_probe: bool = False
+
+        self.user_id: Optional[str] = None
+        self.restored_user_id: Optional[str] = None
 
     async def start(self):
-        if self.db:
-            self.proxies = await self.db.get_proxies_by_email(self.email)
+        if self.db and not self.account:
+            self.proxies = ProxyRing(await self.db.get_proxies_by_email(self.email))
         self.log_global_count(True)
         # logger.info(f"{self.id} | {self.email} | Starting...")
+        try:
+            return await self.work()
+        finally:
+            points_poller.unregister(self)
+            ws_sweeper.unregister(self)
+
+    async def work(self):
+        user_id = None
         while True:
             try:
-                Grass.is_site_down()
-
-                user_id = await self.enter_account()
+                await self.wait_for_site()
+
+                # in warm standby mode the access token survives failover, login is done only once.
+                # A resumed account reuses the token of the previous run for its first connection
+                if self.account:
+                    user_id = await self.account.get_user_id(self.proxy)
+                    self.access_token = self.account.access_token
+                elif self.restored_user_id:
+                    user_id, self.restored_user_id = self.restored_user_id, None
+                elif not (WARM_STANDBY and user_id):
+                    user_id = await self.enter_account()
+                self.user_id = user_id
 
                 browser_id = str(uuid.uuid3(uuid.NAMESPACE_DNS, self.proxy or ""))
 
@@ -66,6 +119,12 @@ class Grass(GrassWs, GrassRest, FailureCounter):
             except LoginException as e:
                 logger.warning(f"LoginException | {self.id} | {e}")
                 return False
+            except TokenExpiredException as e:
+                # the next round logs in again, warm standby included
+                if self.account:
+                    self.account.expire_login(self.access_token)
+                user_id = None
+                msg = f"Access token expired: {e}"
             except (ProxyBlockedException, ProxyForbiddenException) as e:
                 # self.proxies.remove(self.proxy)
                 msg = "Proxy forbidden"
@@ -75,6 +134,9 @@ class Grass(GrassWs, GrassRest, FailureCounter):
                     msg = "Proxy connection closed, switching to next proxy"
                 else:
                     msg = "Low proxy score"
+            except WebsocketStaleException as e:
+                metrics.incr("ws_zombies")
+                msg = f"Dead connection: {e}"
             except WebsocketConnectionFailedError:
                 msg = "Websocket connection failed"
                 self.reach_fail_limit()
@@ -83,35 +145,59 @@ class Grass(GrassWs, GrassRest, FailureCounter):
             except FailureLimitReachedException as e:
                 msg = "Failure limit reached"
                 self.reach_fail_limit()
-            except SiteIsDownException as e:
-                msg = f"Site is down!"
-                self.reach_fail_limit()
             else:
                 msg = ""
 
+            self.record_failure()
+            self.failover_started_at = clock.monotonic()
+
+            # the failure limit counts standby switches too, a site that is down stops the account either way
             await self.failure_handler(
                 is_raise=False,
             )
 
+            if WARM_STANDBY and self.take_standby():
+                logger.info(f"{self.id} | Switched to standby proxy {self.proxy}. {msg}. Reconnecting...")
+                continue
+
             await self.change_proxy()
             logger.info(f"{self.id} | Changed proxy to {self.proxy}. {msg}. Retrying...")
 
-            await asyncio.sleep(random.uniform(20, 21))
+            self.reconnect_attempt += 1
+            await backoff("reconnect").sleep(self.reconnect_attempt)
 
     async def run(self, browser_id: str, user_id: str):
         while True:
             try:
-                # Получаем адрес и токен
-                try:
-                    destination, token = await self.get_addr(browser_id, user_id)
-                    if not destination:
-                        logger.error(f"{self.id} | Failed to get destination address")
-                        raise ProxyError("Failed to get destination address")
-                except Exception as e:
-                    logger.error(f"{self.id} | Error getting address: {e}")
-                    raise ProxyError(f"Error getting address: {e}")
+                if MIN_PROXY_SCORE and self.proxy_score is None:
+                    await self.load_cached_proxy_score()
 
+                # Получаем адрес и токен
+                if self.is_checkin_ready:
+                    self.is_checkin_ready = False
+                else:
+                    try:
+                        destination, token = await self.get_addr(browser_id, user_id)
+                        if not destination:
+                            logger.error(f"{self.id} | Failed to get destination address")
+                            raise ProxyError("Failed to get destination address")
+                    except TokenExpiredException:
+                        raise
+                    except Exception as e:
+                        logger.error(f"{self.id} | Error getting address: {e}")
+                        raise ProxyError(f"Error getting address: {e}")
+
+                connect_started_at = clock.monotonic()
                 await self.connection_handler()
+                self.record_success(clock.monotonic() - connect_started_at)
+
+                if CHECK_POINTS:
+                    points_poller.register(self)
+                ws_sweeper.register(self)
+                self.report_failover()
+
+                if WARM_STANDBY and not self.standby_proxy and not (self.standby_task and not self.standby_task.done()):
+                    self.standby_task = asyncio.create_task(self.prepare_standby(user_id))
 
                 await self.action_extension(browser_id, user_id)
 
@@ -134,31 +220,55 @@ class Grass(GrassWs, GrassRest, FailureCounter):
                     if MIN_PROXY_SCORE and self.proxy_score is None:
                         await self.handle_proxy_score(MIN_PROXY_SCORE, browser_id)
 
-                    if CHECK_POINTS and not (i % 100):
-                        points = await self.get_points_handler()
-                        await self.db.update_or_create_point_stat(self.id, self.email, points)
-                        logger.info(f"{self.id} | Total points: {points}")
                     if i:
                         self.fail_reset()
 
-                    await asyncio.sleep(random.randint(119, 120))
+                    await self.idle(random.randint(119, 120))
             except (WebsocketClosedException, ConnectionResetError, TypeError) as e:
+                # a websocket closed by the sweeper goes through failover, not a reconnect over the same proxy
+                if self.is_stale():
+                    raise WebsocketStaleException(f"No frames for {WS_STALE_AFTER}s") from e
                 logger.info(f"{self.id} | {type(e).__name__}: {e}. Reconnecting...")
             await self.failure_handler(limit=3)
 
-            await asyncio.sleep(5, 10)
-
-    async def claim_rewards(self):
-        await self.enter_account()
-        await self.claim_rewards_handler()
-
-        logger.info(f"{self.id} | Claimed all rewards.")
-
-    @retry(stop=stop_after_attempt(7),
+            await clock.sleep(random.randint(5, 10))
+
+    def snapshot(self) -> dict:
+        return {
+            "proxies": [self.proxy],
+            "proxy_score": self.proxy_score,
+            "user_id": self.user_id,
+            "access_token": self.access_token,
+            "fail_count": self.fail_count,
+            "limit_reached_count": self.limit_reached_count,
+            "reconnect_attempt": self.reconnect_attempt,
+        }
+
+    def restore(self, state: dict):
+        if not self.account and state.get("user_id") and state.get("access_token"):
+            self.restored_user_id = state["user_id"]
+            self.access_token = state["access_token"]
+
+        if state.get("proxies") == [self.proxy]:
+            self.proxy_score = state.get("proxy_score")
+
+        self.fail_count = state.get("fail_count", 0)
+        self.limit_reached_count = state.get("limit_reached_count", 0)
+        self.reconnect_attempt = state.get("reconnect_attempt", 0)
+
+    async def close(self):
+        if self.standby_task:
+            self.standby_task.cancel()
+        for job in self.jobs:
+            job.cancel()
+        self.report_compression()
+        if self.websocket and not self.websocket.closed:
+            await self.websocket.close()
+
+    @retry(**backoff("ws_connect").retry_kwargs(),
            retry=(retry_if_exception_type(ConnectionError) | retry_if_not_exception_type(ProxyForbiddenException)),
            retry_error_callback=lambda retry_state:
            raise_error(WebsocketConnectionFailedError(f"{retry_state.outcome.exception()}")),
-           wait=wait_random(7, 10),
            reraise=True)
     async def connection_handler(self):
         logger.info(f"{self.id} | Connecting...")
@@ -167,54 +277,186 @@ class Grass(GrassWs, GrassRest, FailureCounter):
 
     async def handle_proxy_score(self, min_score: int, browser_id: str):
         for _ in range(3):
-            await asyncio.sleep(25, 30)
+            await self.idle(random.randint(25, 30))
             if (proxy_score := await self.get_proxy_score_by_device_handler(browser_id)) is None:
                 # logger.info(f"{self.id} | Proxy score not found for {self.proxy}. Guess Bad proxies! Continue...")
                 # return None
                 pass
             elif proxy_score >= min_score:
                 self.proxy_score = proxy_score
+                await self.cache_proxy_score(proxy_score)
                 logger.success(f"{self.id} | Proxy score: {self.proxy_score}")
                 return True
             else:
+                await self.cache_proxy_score(proxy_score)
                 raise LowProxyScoreException(
                     f"{self.id} | Too low proxy score: {proxy_score} for {self.proxy}. Retrying...")
 
         logger.info(f"{self.id} | Proxy score not found for {self.proxy}. Waiting for score...")
 
+    async def load_cached_proxy_score(self):
+        if not (self.db and PROXY_SCORE_CACHE_TTL):
+            return
+
+        try:
+            # once per proxy, a known score of the same exit IP behind another proxy url counts too
+            await self.update_ip()
+        except Exception as e:
+            logger.debug(f"{self.id} | Can't get exit IP of {self.proxy}: {e}")
+
+        proxy_score = await self.db.get_proxy_score(self.proxy or "", PROXY_SCORE_CACHE_TTL, self.exit_ip)
+
+        if proxy_score is None:
+            return
+        if proxy_score < MIN_PROXY_SCORE:
+            raise LowProxyScoreException(
+                f"{self.id} | Known low proxy score: {proxy_score} for {self.proxy}. Switching...")
+
+        self.proxy_score = proxy_score
+        get_proxy_health(self.proxy).score = proxy_score
+        logger.info(f"{self.id} | Known proxy score: {self.proxy_score}. Skipping score check...")
+
+    async def cache_proxy_score(self, proxy_score: int):
+        get_proxy_health(self.proxy).score = proxy_score
+
+        if self.db and PROXY_SCORE_CACHE_TTL:
+            await self.db.set_proxy_score(self.proxy or "", proxy_score, self.exit_ip)
+
+    def is_stale(self) -> bool:
+        return clock.monotonic() - self.last_live_timestamp > WS_STALE_AFTER
+
+    @property
+    def exit_ip(self):
+        return self.ip if self.ip_proxy == self.proxy else None
+
+    def record_success(self, latency: float = None):
+        self.reconnect_attempt = 0
+        self.limit_reached_count = 0
+        get_proxy_health(self.proxy).record_success(latency)
+        circuit_breakers.record_success(f"proxy:{self.proxy}")
+
+        if self.site_breaker.record_success():
+            FailureCounter.clear_global_counter()
+        self.is_site_probe = False
+
+    def record_failure(self):
+        get_proxy_health(self.proxy).record_failure()
+        circuit_breakers.record_failure(f"proxy:{self.proxy}")
+
+        if self.is_site_probe:
+            self.site_breaker.record_failure()
+            self.is_site_probe = False
+
+    def report_failover(self):
+        if self.failover_started_at is None:
+            return
+
+        latency = clock.monotonic() - self.failover_started_at
+        self.failover_started_at = None
+
+        metrics.observe("failover_latency", latency)
+        logger.info(f"{self.id} | Failover took {latency:.1f}s")
+
+    async def prepare_standby(self, user_id: str):
+        proxy = await self.pick_standby_proxy()
+        if not proxy:
+            return
+
+        browser_id = str(uuid.uuid3(uuid.NAMESPACE_DNS, proxy))
+
+        try:
+            destination, token = await self.checkin(browser_id, user_id, proxy)
+        except (ProxyError, TokenExpiredException) as e:
+            logger.info(f"{self.id} | Standby proxy {proxy} check-in failed: {e}")
+            return
+
+        self.standby_proxy = proxy
+        self.standby_checkin = (destination, token, clock.monotonic())
+
+    async def pick_standby_proxy(self):
+        await self.fetch_extra_proxy()
+
+        for _ in range(len(self.proxies)):
+            if (proxy := self.proxies.next(self.is_proxy_available)) != self.proxy:
+                return self.pick_proxy(proxy)
+
+    def take_standby(self):
+        if not self.standby_proxy:
+            return False
+
+        destination, token, fetched_at = self.standby_checkin
+        if self.account:
+            self.account.transfer_proxy(self.proxy, self.standby_proxy)
+        self.proxy = self.standby_proxy
+        self.proxy_score = None
+        self.standby_proxy = self.standby_checkin = None
+
+        if clock.monotonic() - fetched_at < WARM_STANDBY_CHECKIN_TTL:
+            self.destination, self.token = destination, token
+            self.is_checkin_ready = True
+
+        return True
+
     async def change_proxy(self):
         self.proxy = await self.get_new_proxy()
+        self.proxy_score = None
+        self.is_checkin_ready = False
 
     async def get_new_proxy(self):
+        await self.fetch_extra_proxy()
+        return await self.next_proxy()
+
+    async def fetch_extra_proxy(self):
+        if self.extra_proxies_seen != self.db.extra_proxies_pushed:
+            self.extra_proxies_seen = self.db.extra_proxies_pushed
+            self.is_extra_proxies_left = True
+
         while self.is_extra_proxies_left:
-            if (proxy := await self.db.get_new_from_extra_proxies("ProxyList")) is not None:
+            if (proxy := await proxy_allocator.acquire(self.db, self.email)) is not None:
                 if proxy not in self.proxies:
                     if email := await self.db.proxies_exist(proxy):
                         if self.email == email:
-                            self.proxies.insert(0, proxy)
+                            self.proxies.add(proxy, front=True)
                             break
                     else:
                         await self.db.add_account(self.email, proxy)
-                        self.proxies.insert(0, proxy)
+                        self.proxies.add(proxy, front=True)
                         break
             else:
                 self.is_extra_proxies_left = False
 
-        return await self.next_proxy()
-
     async def next_proxy(self):
         if not self.proxies:
-            await self.reset_with_delay(f"{self.id} | No proxies left. Use same proxy...", 30 * 60)
+            sleep_time = backoff("no_proxies").next_delay(self.reconnect_attempt + 1)
+            await self.reset_with_delay(f"{self.id} | No proxies left. Use same proxy...", sleep_time)
             return self.proxy
             # raise NoProxiesException(f"{self.id} | No proxies left. Exiting...")
 
-        proxy = self.proxies.pop(0)
-        self.proxies.append(proxy)
+        if self.account:
+            return self.account.reassign_proxy(self.proxy)
 
-        return proxy
+        return self.pick_proxy(self.proxies.next(self.is_proxy_available))
 
     @staticmethod
-    def is_site_down():
-        if STOP_ACCOUNTS_WHEN_SITE_IS_DOWN and Grass.is_global_error():
-            logger.info(f"Site is down. Sleeping for non-working accounts...")
-            raise SiteIsDownException()
\ No newline at end of file
+    def is_proxy_available(proxy: str) -> bool:
+        # proxies with an open circuit are skipped until their recovery probe is due.
+        # Only checks, scanning the candidates must not use up their probes
+        return circuit_breakers.is_available(f"proxy:{proxy}")
+
+    @staticmethod
+    def pick_proxy(proxy: Optional[str]) -> Optional[str]:
+        # the proxy actually handed out takes the recovery probe of its circuit
+        circuit_breakers.is_allowed(f"proxy:{proxy}")
+        return proxy
+
+    async def wait_for_site(self):
+        if not STOP_ACCOUNTS_WHEN_SITE_IS_DOWN:
+            return
+
+        if self.site_breaker.is_closed and Grass.is_global_error():
+            self.site_breaker.trip()
+
+        if not self.site_breaker.is_closed:
+            logger.info(f"{self.id} | Site is down. Sleeping for non-working accounts...")
+            await self.site_breaker.wait_allowed()
+            self.is_site_probe = self.site_breaker.state == CircuitBreaker.HALF_OPEN
\ No newline at end of file
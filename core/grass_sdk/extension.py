@@ -1,23 +1,70 @@
 import asyncio
 import json
-import time
 from base64 import b64decode, b64encode
 from random import choice
 import aiohttp
 from curl_cffi import requests
-from aiohttp import WSMsgType
+from aiohttp import WSMsgType, ServerTimeoutError
 import uuid
+import zlib
+from types import MappingProxyType
 
 from better_proxy import Proxy
 
-from core.utils.exception import WebsocketClosedException, ProxyForbiddenException, ProxyError
+from core.utils import logger, clock
+from core.utils.circuit_breaker import circuit_breakers
+from core.utils.job_limiter import job_limiters
+from core.utils.job_sessions import job_sessions
+from core.utils.metrics import metrics
+from core.utils.traffic import traffic_meter, headers_size
+from core.utils.exception import WebsocketClosedException, WebsocketStaleException, ProxyForbiddenException, \
+    ProxyError, TokenExpiredException
 
 import os, base64
 
-from data.config import NODE_TYPE, USE_WSS
+from data.config import NODE_TYPE, USE_WSS, WS_COMPRESSION, WS_COMPRESSION_SAMPLE_EVERY, WS_RECEIVE_TIMEOUT, \
+    WS_HEARTBEAT, JOB_TIMEOUT
+
+# proxy answers telling that it's overloaded, they shrink the job concurrency of the proxy like an error does
+OVERLOAD_STATUSES = frozenset((407, 429, 502, 503, 504))
+
+WS_COMPRESSION_WBITS = 15
+
+# header templates, placeholders keep the header order when per-connection values are filled in
+CHECKIN_HEADERS = MappingProxyType({
+    'User-Agent': '',
+    'Accept': '*/*',
+    'Origin': 'chrome-extension://lkbnfiajjmbhnfledhphioinpickokdi',
+    'Content-Type': 'application/json',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Storage-Access': 'active',
+    'Accept-Encoding': 'gzip, deflate, br, zstd',
+    'Accept-Language': 'en-US;q=0.8,en;q=0.7',
+})
+
+# Точный набор заголовков как в Charles
+WS_HEADERS = MappingProxyType({
+    'Host': '',
+    'Connection': 'Upgrade',
+    'Pragma': 'no-cache',
+    'Cache-Control': 'no-cache',
+    'User-Agent': '',
+    'Upgrade': 'websocket',
+    'Origin': 'chrome-extension://lkbnfiajjmbhnfledhphioinpickokdi',
+    'Sec-WebSocket-Version': '13',
+    'Accept-Encoding': 'gzip, deflate',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Sec-WebSocket-Key': '',
+    'Accept': ''
+})
 
 
 class GrassWs:
+    # attributes live in the slots of the concrete client (Grass), so it has a single instance layout
+    __slots__ = ()
+
     def __init__(self, user_agent: str = None, proxy: str = None):
         self.user_agent = user_agent
         self.proxy = proxy
@@ -26,11 +73,21 @@ class GrassWs:
         self.session = None
         self.websocket = None
         self.id = None
-        self.last_live_timestamp = time.time()
+        # monotonic time of the last frame received, checked by the stale connection sweeper
+        self.last_live_timestamp = clock.monotonic()
         # self.ws_session = None
+        self.ws_compress = 0
+        self.ws_compressed_frames = 0
+        self.ws_compression_ratio = 1.0
+        self.ws_bytes_saved = 0
+        # HTTP_REQUEST jobs in progress, they run next to the ping loop
+        self.jobs = set()
 
     async def get_addr(self, browser_id: str, user_id: str):
-        
+        self.destination, self.token = await self.checkin(browser_id, user_id, self.proxy)
+        return self.destination, self.token
+
+    async def checkin(self, browser_id: str, user_id: str, proxy: str = None):
         message = {
             "browserId": browser_id,
 	        "userId": user_id,
@@ -40,41 +97,60 @@ class GrassWs:
 	        "deviceType": "extension"
                 }
 
-        headers = {
-                'User-Agent': self.user_agent,
-                'Accept': '*/*',
-                'Origin': 'chrome-extension://lkbnfiajjmbhnfledhphioinpickokdi',
-                'Content-Type': 'application/json',
-                'Sec-Fetch-Site': 'none',
-                'Sec-Fetch-Mode': 'cors',
-                'Sec-Fetch-Dest': 'empty',
-                'Sec-Fetch-Storage-Access': 'active',
-                'Accept-Encoding': 'gzip, deflate, br, zstd',
-                'Accept-Language': 'en-US;q=0.8,en;q=0.7',
-        }
+        headers = {**CHECKIN_HEADERS, 'User-Agent': self.user_agent}
+        breaker = circuit_breakers.get("host:director.getgrass.io")
+        await breaker.wait_allowed()
+
         try:
-            response = requests.post(
-                'https://director.getgrass.io/checkin',
-                json=message,
-                headers=headers,
-                proxies={'http': self.proxy, 'https': self.proxy} if self.proxy else None,
-                impersonate="chrome" ,
-                verify=False,
-                timeout=30
-            )
+            # every outcome reaches the breaker, a half-open probe that never reports holds all check-ins back.
+            # Only answers of the director count for it, a dead proxy is a failure of the proxy circuit
+            is_success = None
+            try:
+                # curl_cffi is blocking, keep it off the event loop so standby check-ins can run in background
+                response = await asyncio.to_thread(
+                    requests.post,
+                    'https://director.getgrass.io/checkin',
+                    json=message,
+                    headers=headers,
+                    proxies={'http': proxy, 'https': proxy} if proxy else None,
+                    impersonate="chrome" ,
+                    verify=False,
+                    timeout=30
+                )
+
+                if response.status_code >= 500:
+                    is_success = False
+                elif 200 <= response.status_code < 300:
+                    is_success = True
+            except (requests.exceptions.ProxyError, requests.exceptions.Timeout,
+                    requests.exceptions.ConnectionError) as e:
+                # curl reports a timeout during the transfer as "Operation timed out", the rest never reached the host
+                if proxy and "Operation timed out" not in str(e):
+                    circuit_breakers.record_failure(f"proxy:{proxy}")
+                elif not isinstance(e, requests.exceptions.ProxyError):
+                    is_success = False
+                raise
+            finally:
+                breaker.record(is_success)
+
+            traffic_meter.record(proxy, self.email, "checkin",
+                                 sent=len(json.dumps(message)) + headers_size(headers),
+                                 received=len(response.content) + headers_size(response.headers))
 
+            if response.status_code == 401:
+                raise TokenExpiredException(f"Check-in response: {response.status_code}")
             if response.status_code == 201:
                 try:
                     data = response.json()
-                    self.destination = data.get('destinations')[0] if data.get('destinations') else None
-                    self.token = data.get('token')
+                    destination = data.get('destinations')[0] if data.get('destinations') else None
+                    token = data.get('token')
 
                     # Проверяем, что получили все необходимые данные
-                    if not self.destination or not self.token:
-                        #print(f"Incomplete data received: destination={self.destination}, token={self.token}")
+                    if not destination or not token:
+                        #print(f"Incomplete data received: destination={destination}, token={token}")
                         raise ProxyError(f"Incomplete data from server: {data}")
 
-                    return self.destination, self.token
+                    return destination, token
                 except (ValueError, json.JSONDecodeError) as e:
                     #print(f"JSON decode error: {e}, response: {response.text}")
                     raise ProxyError(f"JSON decode error: {e}")
@@ -91,6 +167,8 @@ class GrassWs:
                 raise ProxyError("Proxy connection closed")
             #print(f"Proxy error: {e}")
             raise ProxyError(f"Proxy error: {e}")
+        except TokenExpiredException:
+            raise
         except Exception as e:
             #print(f"Error getting connection info: {type(e).__name__}: {e}")
             if "connection to proxy closed" in str(e):
@@ -104,30 +182,27 @@ class GrassWs:
         random_bytes = os.urandom(16)
         sec_websocket_key = base64.b64encode(random_bytes).decode('utf-8')
 
-        # Точный набор заголовков как в Charles
-        headers = {
-            'Host': self.destination,
-            'Connection': 'Upgrade',
-            'Pragma': 'no-cache',
-            'Cache-Control': 'no-cache',
-            'User-Agent': self.user_agent,
-            'Upgrade': 'websocket',
-            'Origin': 'chrome-extension://lkbnfiajjmbhnfledhphioinpickokdi',
-            'Sec-WebSocket-Version': '13',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Sec-WebSocket-Key': sec_websocket_key,
-            'Sec-WebSocket-Extensions': 'permessage-deflate; client_max_window_bits',
-            'Accept': ''
-        }
+        headers = {**WS_HEADERS, 'Host': self.destination, 'User-Agent': self.user_agent,
+                   'Sec-WebSocket-Key': sec_websocket_key}
+
+        self.report_compression()
 
         try:
+            # aiohttp adds 'Sec-WebSocket-Extensions: permessage-deflate' itself and only then
+            # understands compressed frames from the server
             self.websocket = await self.session.ws_connect(
                 uri,
                 headers=headers,
                 proxy=self.proxy,
-                ssl=USE_WSS  # Используем SSL только для WSS
+                ssl=USE_WSS,  # Используем SSL только для WSS
+                compress=WS_COMPRESSION_WBITS if WS_COMPRESSION else 0,
+                heartbeat=WS_HEARTBEAT or None
             )
+            self.last_live_timestamp = clock.monotonic()
+            traffic_meter.record(self.proxy, self.email, "ws", sent=len(uri) + headers_size(headers))
+
+            # aiohttp deflates every frame once compression is negotiated, there is no opting a frame out
+            self.ws_compress = self.websocket.compress
 
         except Exception as e:
             if 'status' in dir(e) and e.status == 403:
@@ -137,18 +212,69 @@ class GrassWs:
     async def send_message(self, message):
         await self.websocket.send_str(message)
 
-    async def receive_message(self):
-        msg = await self.websocket.receive()
-        if msg.type == WSMsgType.CLOSED:
+        # frames are counted uncompressed both ways, the compression saving is an estimate for the metrics only
+        traffic_meter.record(self.proxy, self.email, "ws", sent=len(message), requests=0)
+        if self.ws_compress:
+            self.estimate_bytes_saved(message)
+
+    def estimate_bytes_saved(self, message: str):
+        # every Nth compressed frame is deflated once more the way aiohttp does it to keep the ratio current
+        if not self.ws_compressed_frames % WS_COMPRESSION_SAMPLE_EVERY:
+            data = message.encode()
+            compressor = zlib.compressobj(level=zlib.Z_BEST_SPEED, wbits=-self.ws_compress)
+            compressed_size = len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+            self.ws_compression_ratio = compressed_size / len(data)
+
+        self.ws_compressed_frames += 1
+        saved = max(int(len(message) * (1 - self.ws_compression_ratio)), 0)
+        self.ws_bytes_saved += saved
+
+    def report_compression(self):
+        if self.ws_bytes_saved:
+            metrics.incr("ws_bytes_saved", self.ws_bytes_saved)
+            metrics.observe("ws_kb_saved_per_connection", self.ws_bytes_saved / 1024)
+            logger.debug(f"{self.id} | Websocket compression saved ~{self.ws_bytes_saved / 1024:.1f} KB "
+                         f"over {self.ws_compressed_frames} frames")
+
+        self.ws_compressed_frames = 0
+        self.ws_bytes_saved = 0
+
+    async def receive_message(self, timeout: float = None):
+        # raises asyncio.TimeoutError if no frame came in `timeout` seconds
+        msg = await self.websocket.receive(timeout=timeout)
+
+        if msg.type == WSMsgType.ERROR and isinstance(msg.data, ServerTimeoutError):
+            raise WebsocketStaleException(f"No heartbeat pong in {WS_HEARTBEAT / 2:g}s")
+        if msg.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
             raise WebsocketClosedException(f"Websocket closed: {msg}")
+
+        self.last_live_timestamp = clock.monotonic()
+        traffic_meter.record(self.proxy, self.email, "ws", received=len(msg.data), requests=0)
         return json.loads(msg.data)
 
     async def get_connection_id(self):
-        return await self.receive_message()
+        try:
+            return await self.receive_message(timeout=WS_RECEIVE_TIMEOUT or None)
+        except asyncio.TimeoutError:
+            raise WebsocketStaleException(f"No answer from server in {WS_RECEIVE_TIMEOUT}s")
+
+    async def idle(self, delay: float):
+        # frames are read while waiting: aiohttp handles heartbeat pongs only inside a pending receive,
+        # and anything the server sends in between is answered right away
+        deadline = clock.monotonic() + delay
+
+        while (left := deadline - clock.monotonic()) > 0:
+            try:
+                received_message = await self.receive_message(timeout=left)
+            except asyncio.TimeoutError:
+                return
+            await self.handle_message(received_message)
 
     async def action_extension(self, browser_id: str, user_id: str):
         # Получаем сообщение от сервера
-        received_message = await self.get_connection_id()
+        await self.handle_message(await self.get_connection_id())
+
+    async def handle_message(self, received_message: dict):
         message_id = received_message.get("id")
         action = received_message.get("action")
         data = received_message.get("data", {})
@@ -156,15 +282,10 @@ class GrassWs:
 
 
         if action == "HTTP_REQUEST":
-            result = await self.perform_http_request(data)
-
-            response = {
-                "id": message_id,
-                "origin_action": action,
-                "result": result
-            }
-
-            await self.send_message(json.dumps(response))
+            # a slow job doesn't hold the PING/PONG exchange, the proxy job limiter decides how many run at once
+            job = asyncio.create_task(self.run_job(message_id, action, data))
+            self.jobs.add(job)
+            job.add_done_callback(self.jobs.discard)
         elif action == "PONG":
             response = {
                 "id": message_id,
@@ -172,29 +293,67 @@ class GrassWs:
             }
             await self.send_message(json.dumps(response))
 
+    async def run_job(self, message_id: str, action: str, data: dict):
+        websocket = self.websocket
+        result = await self.perform_http_request(data)
+
+        if self.websocket is not websocket or websocket.closed:
+            # the job belongs to a connection that is gone, its id means nothing to the next one
+            return
+
+        response = {
+            "id": message_id,
+            "origin_action": action,
+            "result": result
+        }
+
+        try:
+            await self.send_message(json.dumps(response))
+        except (ConnectionError, aiohttp.ClientError) as e:
+            logger.debug(f"{self.id} | Job result not sent: {e}")
+
     async def perform_http_request(self, params: dict) -> dict:
         headers = params.get("headers", {})
         method = params.get("method", "GET")
         url = params["url"]
         body = params.get("body")
 
+        limiter = job_limiters.get(self.proxy)
+        if not await limiter.acquire():
+            metrics.incr("jobs_rejected")
+            return {
+                "url": url,
+                "status": 429,
+                "status_text": "Too Many Requests",
+                "headers": {},
+                "body": ""
+            }
+
+        started_at = clock.monotonic()
+        # stays None if the job is cancelled
+        is_success = None
+
         try:
-            response = requests.request(
-                method=method,
-                url=url,
+            # connections to the target through this proxy are kept alive between jobs
+            response = await job_sessions.request(
+                self.proxy,
+                method,
+                url,
                 headers=headers,
                 data=body,
-                proxies={'http': self.proxy, 'https': self.proxy} if self.proxy else None,
-                impersonate="chrome",
-                verify=False,
-                timeout=30
+                timeout=JOB_TIMEOUT
             )
+            is_success = response.status_code not in OVERLOAD_STATUSES
             
             # Извлечение заголовков
             headers_dict = dict(response.headers)
             
             # Получаем тело ответа и кодируем в base64
             body_bytes = response.content
+
+            traffic_meter.record(self.proxy, self.email, "job",
+                                 sent=len(method) + len(url) + headers_size(headers) + len(body or ""),
+                                 received=len(body_bytes) + headers_size(headers_dict))
             body_base64 = b64encode(body_bytes).decode('utf-8')
 
             return {
@@ -205,6 +364,7 @@ class GrassWs:
                 "body": body_base64
             }
         except Exception as e:
+            is_success = False
             print(f"Error occurred while performing fetch: {e}")
             return {
                 "url": url,
@@ -212,7 +372,9 @@ class GrassWs:
                 "status_text": "Bad Request",
                 "headers": {},
                 "body": ""
-            }    
+            }
+        finally:
+            limiter.release(clock.monotonic() - started_at, is_success)
 
     async def send_ping(self):
         message = json.dumps(
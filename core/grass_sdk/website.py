@@ -1,78 +1,89 @@
 import ast
 import asyncio
 import json
-import random
 import time
 
-from aiohttp import ContentTypeError, ClientConnectionError
-from tenacity import retry, stop_after_attempt, wait_random, retry_if_not_exception_type
+from aiohttp import ContentTypeError, ClientConnectionError, ClientConnectorError, ClientHttpProxyError, \
+    ConnectionTimeoutError, SocketTimeoutError
+from tenacity import retry, retry_if_not_exception_type
 
 from core.utils import logger
-from core.utils.exception import LoginException, ProxyBlockedException, CloudFlareHtmlException, ProxyScoreNotFoundException
+from core.utils.backoff import backoff
+from core.utils.circuit_breaker import circuit_breakers
+from core.utils.traffic import traffic_meter, headers_size
+from core.utils.exception import LoginException, ProxyBlockedException, CloudFlareHtmlException, ProxyScoreNotFoundException, \
+    TokenExpiredException, ClaimRefusedException
 from core.utils.session import BaseClient
 
 
 class GrassRest(BaseClient):
+    __slots__ = ("email", "password", "id")
+
     def __init__(self, email: str, password: str, user_agent: str = None, proxy: str = None):
         super().__init__(user_agent, proxy)
         self.email = email
         self.password = password
         self.id = None
 
+    async def request(self, method: str, url: str, data: str = None):
+        headers = self.website_headers
+        response = await self.session.request(method, url, headers=headers, data=data, proxy=self.proxy)
+        # body is cached by aiohttp, so later .json()/.text() calls don't read it again
+        body = await response.read()
+
+        traffic_meter.record(self.proxy, self.email, "rest",
+                             sent=len(method) + len(url) + headers_size(headers) + len(data or ""),
+                             received=len(body) + headers_size(response.raw_headers))
+        return response
+
     async def enter_account(self):
         res_json = await self.handle_login()
-        self.website_headers['Authorization'] = res_json['result']['data']['accessToken']
+        self.access_token = res_json['result']['data']['accessToken']
 
         return res_json['result']['data']['userId']
 
-    @retry(stop=stop_after_attempt(3),
+    @retry(**backoff("retrieve_user").retry_kwargs(),
            before_sleep=lambda retry_state, **kwargs: logger.info(f"Retrying... {retry_state.outcome.exception()}"),
            reraise=True)
     async def retrieve_user(self):
         url = 'https://api.getgrass.io/retrieveUser'
 
-        response = await self.session.get(url, headers=self.website_headers, proxy=self.proxy)
+        response = await self.request("GET", url)
 
         return await response.json()
 
-    async def claim_rewards_handler(self):
-        handler = retry(
-            stop=stop_after_attempt(3),
-            before_sleep=lambda retry_state, **kwargs: logger.info(f"{self.id} | Retrying to claim rewards... "
-                                                                   f"Continue..."),
-            wait=wait_random(5, 7),
-            reraise=True
-        )
-
-        for _ in range(8):
-            await handler(self.claim_reward_for_tier)()
-            await asyncio.sleep(random.uniform(1, 3))
+    async def claim_next_reward(self):
+        # True - a tier was claimed, False - the api answered that it's claimed or not reached yet.
+        # Throttling and other refusals raise, the account is retried and never checkpointed as done
+        url = 'https://api.getgrass.io/claimReward'
 
-        return True
+        response = await self.request("POST", url)
 
-    async def claim_reward_for_tier(self):
-        url = 'https://api.getgrass.io/claimReward'
+        if response.status == 401:
+            raise TokenExpiredException(f"Claim response: {response.status}")
+        if response.status >= 500:
+            raise ClientConnectionError(f"Claim response: {response.status}")
+        if not 200 <= response.status < 300:
+            raise ClaimRefusedException(f"Claim response: {response.status}")
 
-        response = await self.session.post(url, headers=self.website_headers, proxy=self.proxy)
+        try:
+            res_json = await response.json()
+        except ContentTypeError:
+            raise ClientConnectionError(f"Claim response: {response.status}, not a json")
 
-        assert (await response.json()).get("result") == {}
-        return True
+        return res_json.get("result") == {}
 
+    @retry(**backoff("points").retry_kwargs(),
+           before_sleep=lambda retry_state, **kwargs: logger.info(f"{retry_state.args[0].id} | Retrying to get "
+                                                                  f"points... Continue..."),
+           reraise=True)
     async def get_points_handler(self):
-        handler = retry(
-            stop=stop_after_attempt(3),
-            before_sleep=lambda retry_state, **kwargs: logger.info(f"{self.id} | Retrying to get points... "
-                                                                   f"Continue..."),
-            wait=wait_random(5, 7),
-            reraise=True
-        )
-
-        return await handler(self.get_points)()
+        return await self.get_points()
 
     async def get_points(self):
         url = 'https://api.getgrass.io/users/earnings/epochs'
 
-        response = await self.session.get(url, headers=self.website_headers, proxy=self.proxy)
+        response = await self.request("GET", url)
 
         #logger.debug(f"{self.id} | Get Points response: {await response.text()}")
 
@@ -88,17 +99,13 @@ class GrassRest(BaseClient):
         else:
             return "Can't get points."
 
+    @retry(**backoff("login").retry_kwargs(),
+           retry=retry_if_not_exception_type((LoginException, ProxyBlockedException)),
+           before_sleep=lambda retry_state, **kwargs: logger.info(f"{retry_state.args[0].id} | Login retrying... "
+                                                                  f"{retry_state.outcome.exception()}"),
+           reraise=True)
     async def handle_login(self):
-        handler = retry(
-            stop=stop_after_attempt(12),
-            retry=retry_if_not_exception_type((LoginException, ProxyBlockedException)),
-            before_sleep=lambda retry_state, **kwargs: logger.info(f"{self.id} | Login retrying... "
-                                                                   f"{retry_state.outcome.exception()}"),
-            wait=wait_random(8, 12),
-            reraise=True
-        )
-
-        return await handler(self.login)()
+        return await self.login()
 
     async def login(self):
         url = 'https://api.getgrass.io/login'
@@ -108,8 +115,33 @@ class GrassRest(BaseClient):
             'username': self.email,
         }
 
-        response = await self.session.post(url, headers=self.website_headers, data=json.dumps(json_data),
-                                           proxy=self.proxy)
+        breaker = circuit_breakers.get("host:api.getgrass.io")
+        await breaker.wait_allowed()
+
+        # every outcome reaches the breaker, a half-open probe that never reports holds all logins back.
+        # Only answers of the host count for it, a dead proxy is a failure of the proxy circuit
+        is_success = None
+        try:
+            response = await self.request("POST", url, data=json.dumps(json_data))
+
+            if response.status >= 500:
+                is_success = False
+            elif 200 <= response.status < 300:
+                is_success = True
+        except (ClientConnectorError, ClientHttpProxyError, ConnectionTimeoutError):
+            # the connection never reached the host
+            if self.proxy:
+                circuit_breakers.record_failure(f"proxy:{self.proxy}")
+            else:
+                is_success = False
+            raise
+        except (SocketTimeoutError, asyncio.TimeoutError):
+            # connected, the host went silent
+            is_success = False
+            raise
+        finally:
+            breaker.record(is_success)
+
         try:
             res_json = await response.json()
             if res_json.get("error") is not None:
@@ -143,43 +175,37 @@ class GrassRest(BaseClient):
     async def get_user_info(self):
         url = 'https://api.getgrass.io/users/dash'
 
-        response = await self.session.get(url, headers=self.website_headers, proxy=self.proxy)
+        response = await self.request("GET", url)
         return await response.json()
 
     async def get_devices_info(self):
         url = 'https://api.getgrass.io/activeIps'  # /extension/user-score /activeDevices
 
-        response = await self.session.get(url, headers=self.website_headers, proxy=self.proxy)
+        response = await self.request("GET", url)
         return await response.json()
 
     async def get_device_info(self, device_id: str):
         url = f"https://api.getgrass.io/retrieveDevice?input=%7B%22deviceId%22:%22{device_id}%22%7D"
-        response = await self.session.get(url, headers=self.website_headers, proxy=self.proxy)
+        response = await self.request("GET", url)
         return await response.json()
 
+    @retry(**backoff("proxy_score").retry_kwargs(),
+           before_sleep=lambda retry_state, **kwargs: logger.info(f"{retry_state.args[0].id} | Retrying to get "
+                                                                  f"proxy score... Continue..."),
+           reraise=True)
     async def get_proxy_score_by_device_handler(self, browser_id: str):
-        handler = retry(
-            stop=stop_after_attempt(3),
-            before_sleep=lambda retry_state, **kwargs: logger.info(f"{self.id} | Retrying to get proxy score... "
-                                                                   f"Continue..."),
-            reraise=True
-        )
-
-        return await handler(lambda: self.get_proxy_score_via_device(browser_id))()
+        return await self.get_proxy_score_via_device(browser_id)
 
     async def get_proxy_score_via_device(self, device_id: str):
         res_json = await self.get_device_info(device_id)
         return res_json.get("result", {}).get("data", {}).get("ipScore", None)
 
+    @retry(**backoff("proxy_score").retry_kwargs(),
+           before_sleep=lambda retry_state, **kwargs: logger.info(f"{retry_state.args[0].id} | Retrying to get "
+                                                                  f"proxy score... Continue..."),
+           reraise=True)
     async def get_proxy_score_via_devices_by_device_handler(self):
-        handler = retry(
-            stop=stop_after_attempt(3),
-            before_sleep=lambda retry_state, **kwargs: logger.info(f"{self.id} | Retrying to get proxy score... "
-                                                                   f"Continue..."),
-            reraise=True
-        )
-
-        return await handler(self.get_proxy_score_via_devices_v1)()
+        return await self.get_proxy_score_via_devices_v1()
 
     async def get_proxy_score_via_devices_v1(self):
         res_json = await self.get_devices_info()
@@ -196,7 +222,7 @@ class GrassRest(BaseClient):
     async def get_proxy_score_via_devices(self):
         url = 'https://api.getgrass.io/users/devices'
 
-        response = await self.session.get(url, headers=self.website_headers, proxy=self.proxy)
+        response = await self.request("GET", url)
 
         if response.status != 200:
             raise ProxyScoreNotFoundException(f"Get proxy score response: {await response.text()}")
@@ -204,11 +230,17 @@ class GrassRest(BaseClient):
         return await response.json()
 
     async def update_ip(self):
-        return await self.get_ip()
+        # exit IP only changes together with the proxy, so /ip is asked once per proxy
+        if self.ip is None or self.ip_proxy != self.proxy:
+            res_json = await self.get_ip()
+            self.ip = res_json.get("ip") if isinstance(res_json, dict) else None
+            self.ip_proxy = self.proxy
+
+        return self.ip
 
     async def get_ip(self):
         url = 'https://api.getgrass.io/ip'
 
-        response = await self.session.get(url, headers=self.website_headers, proxy=self.proxy)
+        response = await self.request("GET", url)
 
         return await response.json()
\ No newline at end of file
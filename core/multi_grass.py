@@ -0,0 +1,106 @@
+import asyncio
+from collections import Counter
+from typing import List, Optional
+
+import aiohttp
+from fake_useragent import UserAgent
+
+from .grass import Grass
+from .grass_sdk.website import GrassRest
+from .utils import logger
+from .utils.accounts_db import AccountsDB
+from .utils.proxy_ring import ProxyRing, get_proxy_health
+from .utils.session import get_shared_session
+
+
+class MultiGrass(GrassRest):
+    # one account with several websocket connections: login, session and proxies are shared
+
+    def __init__(self, _id: int, email: str, password: str, connections: int, proxy: str = None,
+                 db: AccountsDB = None, user_agent: str = None):
+        super().__init__(email=email, password=password,
+                         user_agent=user_agent or str(UserAgent(platforms=['desktop']).random),
+                         proxy=proxy)
+        self.id: int = _id
+        self.db: AccountsDB = db
+        self.connections_amount: int = connections
+
+        self.session: aiohttp.ClientSession = get_shared_session()
+
+        self.proxies: ProxyRing = ProxyRing([proxy] if proxy else ())
+        self.proxy_load: Counter = Counter()
+        self.connections: List[Grass] = []
+
+        self.user_id: Optional[str] = None
+        self.login_lock = asyncio.Lock()
+        self.restored: Optional[dict] = None
+
+    async def start(self):
+        if self.db:
+            for proxy in await self.db.get_proxies_by_email(self.email):
+                self.proxies.add(proxy)
+
+        self.connections = [
+            Grass(_id=f"{self.id}.{i}", email=self.email, password=self.password, db=self.db,
+                  user_agent=self.user_agent, proxy=self.reassign_proxy(None), account=self)
+            for i in range(1, self.connections_amount + 1)
+        ]
+
+        if self.restored:
+            for connection, state in zip(self.connections, self.restored.get("connections", [])):
+                connection.restore(state)
+
+        logger.info(f"{self.id} | {self.email} | Starting {len(self.connections)} connections "
+                    f"over {len(self.proxies)} proxies...")
+
+        results = await asyncio.gather(*(connection.start() for connection in self.connections))
+        return any(result is not False for result in results)
+
+    def snapshot(self) -> dict:
+        connections = [connection.snapshot() for connection in self.connections]
+        return {
+            "proxies": [state["proxies"][0] for state in connections],
+            "user_id": self.user_id,
+            "access_token": self.access_token,
+            "connections": connections,
+        }
+
+    def restore(self, state: dict):
+        if state.get("user_id") and state.get("access_token"):
+            self.user_id = state["user_id"]
+            self.access_token = state["access_token"]
+        self.restored = state
+
+    async def close(self):
+        await asyncio.gather(*(connection.close() for connection in self.connections), return_exceptions=True)
+
+    async def get_user_id(self, proxy: str = None):
+        async with self.login_lock:
+            if self.user_id is None:
+                self.proxy = proxy
+                self.user_id = await self.enter_account()
+
+        return self.user_id
+
+    def expire_login(self, access_token: Optional[str]):
+        # every connection reports the same expired token, only the first one makes the account log in again
+        if access_token == self.access_token:
+            self.user_id = None
+
+    def reassign_proxy(self, old_proxy: Optional[str]) -> Optional[str]:
+        # fair scheduling: the least loaded allowed proxy wins, health breaks ties
+        if not self.proxies:
+            return old_proxy
+
+        candidates = [proxy for proxy in self.proxies if Grass.is_proxy_available(proxy)]
+        proxy = Grass.pick_proxy(min(candidates or self.proxies,
+                                     key=lambda p: (self.proxy_load[p] - (p == old_proxy), p == old_proxy,
+                                                    -get_proxy_health(p).weight)))
+
+        self.transfer_proxy(old_proxy, proxy)
+        return proxy
+
+    def transfer_proxy(self, old_proxy: Optional[str], new_proxy: str):
+        if old_proxy in self.proxy_load:
+            self.proxy_load[old_proxy] -= 1
+        self.proxy_load[new_proxy] += 1
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, Optional
+
+from .utils import logger, clock
+from .utils.accounts_db import AccountsDB
+from .utils.proxy_ring import get_proxy_health
+from data.config import POINTS_POLL_INTERVAL, POINTS_FLUSH_INTERVAL
+
+
+class PointsPoller:
+    # one poll per unique email per interval, spread evenly, instead of every connection polling on its own
+
+    def __init__(self, interval: float = POINTS_POLL_INTERVAL, flush_interval: float = POINTS_FLUSH_INTERVAL):
+        self.interval = interval
+        self.flush_interval = flush_interval
+
+        self.db: Optional[AccountsDB] = None
+        self.clients: Dict[str, dict] = {}
+        self.pending: Dict[str, tuple] = {}
+        self.polls = set()
+        self.task: Optional[asyncio.Task] = None
+        self.flushed_at = clock.monotonic()
+
+    def start(self, db: AccountsDB):
+        self.db = db
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Points flush failed: {e}")
+
+    def register(self, client):
+        self.clients.setdefault(client.email, {})[client.id] = client
+
+    def unregister(self, client):
+        if (clients := self.clients.get(client.email)) is not None:
+            clients.pop(client.id, None)
+            if not clients:
+                del self.clients[client.email]
+
+    async def run(self):
+        while True:
+            emails = list(self.clients)
+
+            if not emails:
+                await clock.sleep(min(self.interval, 60))
+                continue
+
+            step = self.interval / len(emails)
+
+            for email in emails:
+                if client := self.pick_client(email):
+                    poll = asyncio.create_task(self.poll(client))
+                    self.polls.add(poll)
+                    poll.add_done_callback(self.polls.discard)
+
+                if clock.monotonic() - self.flushed_at >= self.flush_interval:
+                    try:
+                        await self.flush()
+                    except Exception as e:
+                        logger.error(f"Points flush failed: {e}")
+
+                await clock.sleep(step)
+
+            try:
+                logger.info(f"Total points of {len(emails)} accounts: {await self.db.get_total_points()}")
+            except Exception as e:
+                logger.error(f"Can't get total points: {e}")
+
+    def pick_client(self, email: str):
+        # prefer a connected client behind the healthiest proxy
+        clients = self.clients.get(email)
+        if not clients:
+            return None
+
+        return max(clients.values(), key=lambda client: (
+            client.websocket is not None and not client.websocket.closed,
+            get_proxy_health(client.proxy).weight
+        ))
+
+    async def poll(self, client):
+        try:
+            points = await client.get_points_handler()
+        except Exception as e:
+            logger.info(f"{client.id} | Can't get points: {e}")
+            return
+
+        # PointStats is keyed by the integer account id, connections of a multi account have ids like "1.2"
+        account_id = client.account.id if client.account else client.id
+        self.pending[client.email] = (account_id, client.email, points, client.proxy, clock.now())
+        logger.info(f"{client.id} | Total points: {points}")
+
+    async def flush(self):
+        self.flushed_at = clock.monotonic()
+
+        if self.pending and self.db:
+            rows, self.pending = list(self.pending.values()), {}
+            await self.db.update_point_stats([(_id, email, points) for _id, email, points, _, _ in rows])
+            await self.db.append_points_history([(email, proxy, ts, points) for _, email, points, proxy, ts in rows])
+
+
+points_poller = PointsPoller()
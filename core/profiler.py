@@ -0,0 +1,151 @@
+import asyncio
+import os
+import signal
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+from aiohttp import web
+
+from .utils import logger
+from data.config import PROFILER_PORT, PROFILER_DIR, PROFILE_DURATION, PROFILE_SAMPLE_INTERVAL, PROFILER_MEMORY_TOP, \
+    PROFILER_MEMORY_FRAMES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@lru_cache(maxsize=None)
+def module_of(filename: str) -> str:
+    # package directory of a file: core/grass_sdk, core/utils, aiohttp, asyncio...
+    path = os.path.abspath(filename)
+    if path.startswith(ROOT + os.sep) and "site-packages" not in path:
+        return os.path.dirname(os.path.relpath(path, ROOT)).replace(os.sep, "/") or os.path.basename(path)
+
+    parts = path.replace(os.sep, "/").split("/")
+    if "site-packages" in parts:
+        return parts[parts.index("site-packages") + 1]
+    return os.path.splitext(parts[-1])[0] if len(parts) < 2 or parts[-2].startswith("python") else parts[-2]
+
+
+def short_path(filename: str) -> str:
+    path = os.path.abspath(filename)
+    if path.startswith(ROOT + os.sep) and "site-packages" not in path:
+        return os.path.relpath(path, ROOT).replace(os.sep, "/")
+    return f"{module_of(filename)}/{os.path.basename(path)}"
+
+
+class Profiler:
+    # on demand only, nothing is hooked while idle. SIGUSR1 (or POST /profile on localhost) samples the event loop
+    # for PROFILE_DURATION of CPU time into collapsed stacks for flamegraph.pl/speedscope. SIGUSR2 (or POST /memory)
+    # starts tracemalloc, the next one dumps the top allocations grouped by module and stops it
+
+    def __init__(self, port: int = PROFILER_PORT, directory: str = PROFILER_DIR):
+        self.port = port
+        self.directory = directory
+
+        self.stacks: Optional[Counter] = None
+        self.runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+
+        for sig, handler in (("SIGUSR1", self.profile), ("SIGUSR2", self.memory)):
+            if hasattr(signal, sig):
+                # windows has neither the signals nor loop signal handlers, the endpoint is left there
+                loop.add_signal_handler(getattr(signal, sig), handler)
+
+        if self.port:
+            app = web.Application()
+            app.add_routes([web.post("/profile", self.handle_profile), web.post("/memory", self.handle_memory)])
+            self.runner = web.AppRunner(app, access_log=None)
+            await self.runner.setup()
+            await web.TCPSite(self.runner, "127.0.0.1", self.port).start()
+
+    async def stop(self):
+        if self.stacks is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+        if self.runner:
+            await self.runner.cleanup()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def path(self, kind: str, extension: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{kind}_{datetime.now().strftime('%m-%d_%H-%M-%S')}.{extension}")
+
+    def profile(self, duration: float = PROFILE_DURATION) -> Optional[str]:
+        if not hasattr(signal, "setitimer"):
+            logger.warning("Profiler | Sampling needs interval timers, they are missing on this OS")
+            return None
+        if self.stacks is not None:
+            logger.warning("Profiler | Already sampling, wait for it to finish")
+            return None
+
+        path = self.path("profile", "collapsed")
+        self.stacks = Counter()
+        # the interrupted frame of the loop thread is recorded at every tick of CPU time, a thread reading
+        # the frames would only see the points where the loop releases the GIL (mostly select)
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, PROFILE_SAMPLE_INTERVAL, PROFILE_SAMPLE_INTERVAL)
+        asyncio.get_running_loop().call_later(duration, self.write_profile, path)
+
+        logger.info(f"Profiler | Sampling the event loop for {duration:g}s into {path}")
+        return path
+
+    def sample(self, _signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(f"{module_of(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def write_profile(self, path: str):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        stacks, self.stacks = self.stacks, None
+
+        with open(path, "w") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        logger.info(f"Profiler | {sum(stacks.values())} samples written to {path}")
+
+    def memory(self, top: int = PROFILER_MEMORY_TOP) -> Optional[str]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILER_MEMORY_FRAMES)
+            logger.info("Profiler | Tracing allocations, trigger again to dump the top ones")
+            return None
+
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+        # an allocation belongs to the innermost farm frame that led to it, library internals count for the caller
+        by_module, by_line = Counter(), Counter()
+        for stat in snapshot.statistics("traceback"):
+            frame = next((frame for frame in reversed(stat.traceback)
+                          if module_of(frame.filename).startswith("core")), stat.traceback[-1])
+            by_module[module_of(frame.filename)] += stat.size
+            by_line[f"{short_path(frame.filename)}:{frame.lineno}"] += stat.size
+
+        path = self.path("memory", "txt")
+        with open(path, "w") as file:
+            file.write(f"Traced {sum(by_module.values()) / 1024 / 1024:.1f} MB\n\nBy module:\n")
+            file.writelines(f"{size / 1024:>10.1f} KB  {module}\n" for module, size in by_module.most_common(top))
+            file.write("\nBy line:\n")
+            file.writelines(f"{size / 1024:>10.1f} KB  {line}\n" for line, size in by_line.most_common(top))
+
+        logger.info(f"Profiler | Allocations snapshot written to {path}")
+        return path
+
+    async def handle_profile(self, request: web.Request):
+        path = self.profile(float(request.query.get("seconds", PROFILE_DURATION)))
+        if path is None:
+            raise web.HTTPConflict(text="Already sampling")
+        return web.json_response({"path": path})
+
+    async def handle_memory(self, request: web.Request):
+        return web.json_response({"path": self.memory(int(request.query.get("top", PROFILER_MEMORY_TOP)))})
+
+
+profiler = Profiler()
@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from .autoreger import AutoReger
+from .grass import Grass
+from .points_poller import points_poller
+from .utils import logger, clock
+from .utils.clock import VirtualClock
+from .utils.exception import WebsocketClosedException, ProxyError
+from .utils.metrics import metrics
+from .utils.rate_limiter import RateLimiter
+from .utils.session import close_shared_session
+from data.config import CHECK_POINTS, RAMP_START_RATE
+
+
+class Scenario:
+    def __init__(self, accounts: int = 1000, hours: float = 24, spare_proxies: float = 0.3,
+                 dead_proxies: float = 0.05, low_score_proxies: float = 0.05, proxy_outages: float = 0.2,
+                 site_outages: tuple = ((6, 30), (15, 90)), ramp_rate: float = RAMP_START_RATE, seed: int = 1):
+        self.accounts = accounts
+        self.hours = hours
+        self.spare_proxies = spare_proxies  # extra proxies per account, put into the spares pool
+        self.dead_proxies = dead_proxies  # share of proxies that never work
+        self.low_score_proxies = low_score_proxies  # share of proxies below MIN_PROXY_SCORE
+        self.proxy_outages = proxy_outages  # share of proxies going down once for 10-120 minutes
+        self.site_outages = site_outages  # (start hour, minutes) of backend outages
+        self.ramp_rate = ramp_rate
+        self.seed = seed
+
+
+class FakeNetwork:
+    # scripted backend and proxies, every request is counted by endpoint
+
+    def __init__(self, scenario: Scenario, proxies: List[str]):
+        rnd = random.Random(scenario.seed)
+        hour, minute = 60 * 60, 60
+
+        self.site_outages = [(start * hour, start * hour + minutes * minute) for start, minutes in scenario.site_outages]
+        self.proxy_outages: Dict[str, tuple] = {}
+        self.scores: Dict[str, int] = {}
+
+        for proxy in proxies:
+            if rnd.random() < scenario.dead_proxies:
+                self.proxy_outages[proxy] = (0, float("inf"))
+            elif rnd.random() < scenario.proxy_outages:
+                start = rnd.uniform(0, scenario.hours * hour)
+                self.proxy_outages[proxy] = (start, start + rnd.uniform(10, 120) * minute)
+
+            self.scores[proxy] = rnd.randint(20, 40) if rnd.random() < scenario.low_score_proxies \
+                else rnd.randint(60, 100)
+
+        self.requests = Counter()
+        self.connected_since: Dict[str, float] = {}
+        self.connected_time = 0.0
+        self.failovers = 0
+        self.points = Counter()
+
+    def is_site_up(self) -> bool:
+        now = clock.monotonic()
+        return not any(start <= now < end for start, end in self.site_outages)
+
+    def is_proxy_up(self, proxy: Optional[str]) -> bool:
+        start, end = self.proxy_outages.get(proxy, (0, 0))
+        return not start <= clock.monotonic() < end
+
+    def request(self, endpoint: str, proxy: Optional[str]):
+        self.requests[endpoint] += 1
+
+        if not self.is_proxy_up(proxy):
+            raise aiohttp.ClientConnectionError(f"Proxy {proxy} is down")
+        if not self.is_site_up():
+            raise aiohttp.ClientConnectionError("Site is down")
+
+    def open(self, client_id: str):
+        self.close(client_id)
+        self.connected_since[client_id] = clock.monotonic()
+
+    def close(self, client_id: str):
+        if (since := self.connected_since.pop(client_id, None)) is not None:
+            self.connected_time += clock.monotonic() - since
+
+    def close_all(self):
+        for client_id in list(self.connected_since):
+            self.close(client_id)
+
+
+class SimDB:
+    # in-memory stand-in for the AccountsDB calls a mining Grass makes
+
+    def __init__(self, accounts: Dict[str, List[str]], spares: List[str]):
+        self.accounts = accounts
+        self.owners = {proxy: email for email, proxies in accounts.items() for proxy in proxies}
+        self.spares = list(spares)
+        self.scores = {}
+        self.extra_proxies_pushed = 0
+
+    async def get_proxies_by_email(self, email):
+        return list(self.accounts.get(email, []))
+
+    async def get_new_from_extra_proxies(self, table="ProxyList"):
+        return self.spares.pop(0) if self.spares else None
+
+    async def count_extra_proxies(self, table="ProxyList"):
+        return len(self.spares)
+
+    async def push_extra_proxies(self, proxies):
+        self.spares.extend(proxies)
+        self.extra_proxies_pushed += 1
+
+    async def proxies_exist(self, proxy):
+        return self.owners.get(proxy, False)
+
+    async def add_account(self, email, proxy):
+        self.accounts.setdefault(email, []).append(proxy)
+        self.owners[proxy] = email
+
+    async def get_proxy_score(self, proxy, ttl, ip=None):
+        return self.scores.get(proxy)
+
+    async def set_proxy_score(self, proxy, score, ip=None):
+        self.scores[proxy] = score
+
+    async def update_point_stats(self, rows):
+        pass
+
+    async def append_points_history(self, rows):
+        pass
+
+    async def get_total_points(self):
+        return 0
+
+    async def get_points_rates(self, by="email", since_hours=24, period=60 * 60):
+        return {}
+
+
+class SimGrass(Grass):
+    # Grass with every network call answered by FakeNetwork, the scheduling and failover logic is the real one
+
+    def __init__(self, network: FakeNetwork, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.network = network
+
+    async def enter_account(self):
+        self.network.request("login", self.proxy)
+        return f"user-{self.email}"
+
+    async def checkin(self, browser_id: str, user_id: str, proxy: str = None):
+        try:
+            self.network.request("checkin", proxy)
+        except aiohttp.ClientError as e:
+            raise ProxyError(f"Check-in failed: {e}")
+        return "simulated-destination", "simulated-token"
+
+    async def connect(self):
+        self.network.request("ws_connect", self.proxy)
+        self.network.open(self.id)
+
+    async def send_ping(self):
+        try:
+            self.network.request("ws_ping", self.proxy)
+        except aiohttp.ClientError as e:
+            self.network.close(self.id)
+            raise WebsocketClosedException(f"{e}")
+
+        self.network.points[self.email] += 1
+
+    async def action_extension(self, browser_id: str, user_id: str):
+        pass
+
+    async def idle(self, delay: float):
+        await clock.sleep(delay)
+
+    async def get_proxy_score_by_device_handler(self, browser_id: str):
+        self.network.request("proxy_score", self.proxy)
+        return self.network.scores.get(self.proxy)
+
+    async def get_ip(self):
+        self.network.request("ip", self.proxy)
+        return {"ip": f"ip-{self.proxy}"}
+
+    async def get_points_handler(self):
+        self.network.request("points", self.proxy)
+        return self.network.points[self.email]
+
+    def record_failure(self):
+        self.network.close(self.id)
+        self.network.failovers += 1
+        super().record_failure()
+
+    async def close(self):
+        self.network.close(self.id)
+
+
+async def run_scenario(scenario: Scenario) -> dict:
+    emails = [f"account{i}@simulation" for i in range(1, scenario.accounts + 1)]
+    proxies = [f"http://10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}:8080"
+               for i in range(int(scenario.accounts * (1 + scenario.spare_proxies)))]
+
+    network = FakeNetwork(scenario, proxies)
+    db = SimDB({email: [proxy] for email, proxy in zip(emails, proxies)}, proxies[len(emails):])
+    start_limiter = RateLimiter(scenario.ramp_rate)
+
+    async def worker(_id: int, email: str, proxy: str):
+        grass = SimGrass(network, _id=_id, email=email, password="simulation", proxy=proxy, db=db,
+                         user_agent="simulation")
+        try:
+            await start_limiter.acquire()
+            return await grass.start()
+        finally:
+            await grass.close()
+
+    autoreger = AutoReger.from_lists((emails, proxies), with_id=True)
+    farm_task = asyncio.create_task(autoreger.start(worker, len(emails)))
+    if CHECK_POINTS:
+        points_poller.start(db)
+
+    await clock.sleep(scenario.hours * 60 * 60)
+
+    network.close_all()
+    await points_poller.stop()
+    await autoreger.stop(timeout=60)
+    farm_task.cancel()
+    await close_shared_session()
+
+    duration = scenario.hours * 60 * 60
+    return {
+        "connected": network.connected_time / (duration * scenario.accounts),
+        "failovers": network.failovers,
+        "failover_p50": metrics.percentile("failover_latency", 0.5),
+        "failover_p95": metrics.percentile("failover_latency", 0.95),
+        "requests_per_hour": {endpoint: amount / scenario.hours for endpoint, amount in network.requests.items()},
+    }
+
+
+def format_report(scenario: Scenario, report: dict, elapsed: float) -> str:
+    lines = [
+        f"Simulated {scenario.hours:g}h of {scenario.accounts} accounts in {elapsed:.1f}s",
+        f"Connected time: {report['connected']:.1%}",
+        f"Failovers: {report['failovers']} ({report['failovers'] / scenario.accounts:.2f} per account)",
+    ]
+
+    if report["failover_p50"] is not None:
+        lines.append(f"Failover latency: p50 {report['failover_p50']:.0f}s | p95 {report['failover_p95']:.0f}s")
+
+    lines.append("Backend requests per hour: " + " | ".join(
+        f"{endpoint} {rate:.0f}" for endpoint, rate in sorted(report["requests_per_hour"].items())))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the farm against a fake network on a virtual clock")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--ramp-rate", type=float, default=RAMP_START_RATE, help="accounts started per second")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show farm logs")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="ERROR")
+
+    scenario = Scenario(accounts=args.accounts, hours=args.hours, ramp_rate=args.ramp_rate, seed=args.seed)
+    random.seed(args.seed)
+
+    virtual_clock = VirtualClock()
+    clock.install(virtual_clock)
+
+    started_at = time.perf_counter()
+    report = virtual_clock.run(run_scenario(scenario))
+    print(format_report(scenario, report, time.perf_counter() - started_at))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,18 @@
 
 import aiosqlite
 import asyncio
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
 import aiohttp
 from aiohttp import ClientProxyConnectionError, ClientConnectorError, ClientTimeout
 import logging
 
-from data.config import CLEAR_BAD_PROXIES_INTERVAL
+from data.config import CLEAR_BAD_PROXIES_INTERVAL, POINTS_ROLLUP_INTERVAL, POINTS_HISTORY_RETENTION_DAYS, \
+    POINTS_HOURLY_RETENTION_DAYS, POINTS_FLUSH_INTERVAL, DB_READ_POOL_SIZE
 
 from core.utils import logger
+from core.utils.metrics import metrics
 
 
 class AccountsDB:
@@ -16,125 +21,492 @@ class AccountsDB:
 
     def __init__(self, db_path):
         self.db_path = db_path
-        self.connection = None
-        self.cursor = None
+        self.connection = None  # the single writer
+        self.readers = None  # idle read-only connections, None - reads go through the writer
+        self.readers_slots = None
         self.db_lock = asyncio.Lock()
         self.logger = logging.getLogger(__name__)
         self.clear_bad_proxies_interval = CLEAR_BAD_PROXIES_INTERVAL
         self.clear_task = None
+        self.rollup_task = None
+        self.proxy_ids = {}
+        self.extra_proxies_pushed = 0  # bumped on every push, so accounts know to look for spares again
+
+        # latest numeric points per email and their sum, so the total never needs a GROUP BY scan
+        self.points_by_email = {}
+        self.points_total = 0
+
+        # read-through caches of data changed only by this process, kept up to date by every write.
+        # After the first full scan of Accounts a missing email or proxy is known to be absent too
+        self.proxies_by_email = {}
+        self.email_by_proxy = {}
+        self.is_accounts_cached = False
+        self.bad_proxies = None  # loaded on the first check
 
     async def connect(self):
         self.connection = await aiosqlite.connect(self.db_path)
-        self.cursor = await self.connection.cursor()
+        # WAL lets readers run next to the writer, each of them sees the last committed state
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        await self.connection.execute("PRAGMA synchronous=NORMAL")
         await self.create_tables()
+        await self.open_readers()
         await self.clear_bad_proxies_on_first_run()
 
         # Запускаем периодическую очистку, если интервал задан
         if self.clear_bad_proxies_interval > 0:
             self.clear_task = asyncio.create_task(self.periodic_clear_bad_proxies())
 
+        if POINTS_ROLLUP_INTERVAL > 0:
+            self.rollup_task = asyncio.create_task(self.periodic_points_rollup())
+
+    async def open_readers(self, size=DB_READ_POOL_SIZE):
+        # an in-memory database is private to its connection, it has no readers
+        if size <= 0 or self.db_path == ":memory:":
+            return
+
+        uri = f"{Path(self.db_path).absolute().as_uri()}?mode=ro"
+        self.readers = [await aiosqlite.connect(uri, uri=True) for _ in range(size)]
+        # the semaphore queues waiting reads fairly, a task releasing a connection can't grab it right back
+        self.readers_slots = asyncio.Semaphore(size)
+
+    async def close_readers(self):
+        if self.readers is not None:
+            for connection in self.readers:
+                await connection.close()
+            self.readers = self.readers_slots = None
+
+    @asynccontextmanager
+    async def read_connection(self):
+        if self.readers is None:
+            async with self.db_lock:
+                yield self.connection
+            return
+
+        async with self.readers_slots:
+            connection = self.readers.pop()
+            try:
+                yield connection
+            finally:
+                self.readers.append(connection)
+
+    async def fetchone(self, query, parameters=()):
+        async with self.read_connection() as connection:
+            async with connection.execute(query, parameters) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, query, parameters=()):
+        async with self.read_connection() as connection:
+            async with connection.execute(query, parameters) as cursor:
+                return await cursor.fetchall()
+
+    @asynccontextmanager
+    async def transaction(self):
+        # writes are serialized on the writer connection, every transaction gets a cursor of its own
+        async with self.db_lock:
+            cursor = await self.connection.cursor()
+            try:
+                yield cursor
+                await self.connection.commit()
+            except BaseException:
+                await self.connection.rollback()
+                raise
+            finally:
+                await cursor.close()
+
+    async def execute(self, query, parameters=()):
+        async with self.transaction() as cursor:
+            await cursor.execute(query, parameters)
+
+    async def executemany(self, query, rows):
+        async with self.transaction() as cursor:
+            await cursor.executemany(query, rows)
+
     async def create_tables(self):
-        await self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Accounts (
-            id INTEGER PRIMARY KEY,
-            email TEXT NOT NULL,
-            proxies TEXT NOT NULL
-        )
-        ''')
-        await self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS ProxyList (
-            id INTEGER PRIMARY KEY,
-            proxy TEXT NOT NULL
-        )
-        ''')
-        await self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS PointStats (
-            id INTEGER PRIMARY KEY,
-            email TEXT NOT NULL,
-            points TEXT NOT NULL
-        )
-        ''')
-        await self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS BadProxies (
-            proxy TEXT PRIMARY KEY
-        )
-        ''')
-        await self.connection.commit()
+        async with self.transaction() as cursor:
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS Accounts (
+                id INTEGER PRIMARY KEY,
+                email TEXT NOT NULL,
+                proxies TEXT NOT NULL
+            )
+            ''')
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ProxyList (
+                id INTEGER PRIMARY KEY,
+                proxy TEXT NOT NULL
+            )
+            ''')
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS PointStats (
+                id INTEGER PRIMARY KEY,
+                email TEXT NOT NULL,
+                points TEXT NOT NULL
+            )
+            ''')
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS BadProxies (
+                proxy TEXT PRIMARY KEY
+            )
+            ''')
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ProxyScores (
+                proxy TEXT PRIMARY KEY,
+                ip TEXT,
+                score INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            ''')
+            await cursor.execute("CREATE INDEX IF NOT EXISTS idx_proxy_scores_ip ON ProxyScores(ip)")
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ProxyLatency (
+                proxy TEXT PRIMARY KEY,
+                director_rtt REAL,
+                api_rtt REAL,
+                is_healthy INTEGER NOT NULL,
+                measured_at REAL NOT NULL
+            )
+            ''')
+            # points history: integer cumulative points per poll, the primary key is the (email, ts) index itself
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ProxyIds (
+                id INTEGER PRIMARY KEY,
+                proxy TEXT NOT NULL UNIQUE
+            )
+            ''')
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS PointsHistory (
+                email TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                points INTEGER NOT NULL,
+                proxy_id INTEGER,
+                PRIMARY KEY (email, ts)
+            ) WITHOUT ROWID
+            ''')
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS Tokens (
+                email TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                access_token TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            ''')
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS Traffic (
+                day INTEGER NOT NULL,
+                proxy TEXT NOT NULL,
+                email TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                sent INTEGER NOT NULL,
+                received INTEGER NOT NULL,
+                requests INTEGER NOT NULL,
+                PRIMARY KEY (day, proxy, email, channel)
+            ) WITHOUT ROWID
+            ''')
+            await cursor.execute('''
+            CREATE TABLE IF NOT EXISTS PointsRollup (
+                period INTEGER NOT NULL,
+                start_ts INTEGER NOT NULL,
+                email TEXT NOT NULL,
+                proxy_id INTEGER NOT NULL,
+                earned INTEGER NOT NULL,
+                seconds INTEGER NOT NULL,
+                PRIMARY KEY (period, start_ts, email, proxy_id)
+            ) WITHOUT ROWID
+            ''')
 
     async def add_account(self, email, new_proxy):
-        async with self.db_lock:
-            await self.cursor.execute("SELECT proxies FROM Accounts WHERE email=?", (email,))
-            existing_proxies = await self.cursor.fetchone()
+        existing_proxies = await self.get_proxies_by_email(email)
+        if new_proxy in existing_proxies:
+            return
 
         if existing_proxies:
-            existing_proxies = existing_proxies[0].split(",")
-            if new_proxy not in existing_proxies:
-                updated_proxies = ",".join(existing_proxies + [new_proxy])
-                async with self.db_lock:
-                    await self.cursor.execute("UPDATE Accounts SET proxies=? WHERE email=?", (updated_proxies, email))
-                    await self.connection.commit()
+            updated_proxies = ",".join(existing_proxies + [new_proxy])
+            await self.execute("UPDATE Accounts SET proxies=? WHERE email=?", (updated_proxies, email))
         else:
-            async with self.db_lock:
-                await self.cursor.execute("INSERT INTO Accounts(email, proxies) VALUES(?, ?)", (email, new_proxy))
-                await self.connection.commit()
+            await self.execute("INSERT INTO Accounts(email, proxies) VALUES(?, ?)", (email, new_proxy))
+
+        self.cache_account(email, existing_proxies + [new_proxy])
 
     async def proxies_exist(self, proxy):
-        async with self.db_lock:
-            await self.cursor.execute("SELECT email, proxies FROM Accounts")
-            rows = await self.cursor.fetchall()
+        if proxy in self.email_by_proxy or self.is_accounts_cached:
+            self.record_cache_lookup("accounts", True)
+            return self.email_by_proxy.get(proxy, False)
+
+        self.record_cache_lookup("accounts", False)
+        rows = await self.fetchall("SELECT email, proxies FROM Accounts")
+
+        for email, proxies in rows:
+            self.cache_account(email, proxies.split(","))
+        self.is_accounts_cached = True
+
+        return self.email_by_proxy.get(proxy, False)
 
-        for row in rows:
-            if len(row) > 1:
-                email = row[0]
-                existing_proxies = row[1].split(",")
-                if proxy in existing_proxies:
-                    return email
-        return False
+    def cache_account(self, email, proxies):
+        for proxy in self.proxies_by_email.get(email, ()):
+            if self.email_by_proxy.get(proxy) == email:
+                del self.email_by_proxy[proxy]
+
+        if proxies is None:
+            self.proxies_by_email.pop(email, None)
+            return
+
+        self.proxies_by_email[email] = proxies
+        for proxy in proxies:
+            # the first account listing a proxy owns it, like the row order of the old scan
+            self.email_by_proxy.setdefault(proxy, email)
+
+    @staticmethod
+    def record_cache_lookup(name, is_hit):
+        metrics.incr(f"{name}_cache_{'hits' if is_hit else 'misses'}")
+        hits, misses = metrics.counters[f"{name}_cache_hits"], metrics.counters[f"{name}_cache_misses"]
+        metrics.gauge(f"{name}_cache_hit_rate", round(hits / (hits + misses), 3))
 
     async def update_or_create_point_stat(self, user_id, email, points):
-        async with self.db_lock:
-            await self.cursor.execute("SELECT * FROM PointStats WHERE id = ?", (user_id,))
-            existing_user = await self.cursor.fetchone()
+        self.track_points(email, points)
+
+        async with self.transaction() as cursor:
+            await cursor.execute("SELECT * FROM PointStats WHERE id = ?", (user_id,))
+            existing_user = await cursor.fetchone()
 
             if existing_user:
-                await self.cursor.execute("UPDATE PointStats SET email = ?, points = ? WHERE id = ?",
-                                          (email, points, user_id))
+                await cursor.execute("UPDATE PointStats SET email = ?, points = ? WHERE id = ?",
+                                     (email, points, user_id))
             else:
-                await self.cursor.execute("INSERT INTO PointStats(id, email, points) VALUES (?, ?, ?)",
-                                          (user_id, email, points))
+                await cursor.execute("INSERT INTO PointStats(id, email, points) VALUES (?, ?, ?)",
+                                     (user_id, email, points))
+
+    async def update_point_stats(self, rows):
+        for _, email, points in rows:
+            self.track_points(email, points)
+
+        await self.executemany("INSERT OR REPLACE INTO PointStats(id, email, points) VALUES (?, ?, ?)", rows)
+
+    async def append_points_history(self, rows):
+        # rows: (email, proxy, ts, points), non-numeric points (errors) are not history
+        rows = [row for row in rows if isinstance(row[3], (int, float))]
+        if not rows:
+            return
+
+        async with self.transaction() as cursor:
+            proxy_ids = await self._get_proxy_ids(cursor, {proxy for _, proxy, _, _ in rows if proxy})
+            await cursor.executemany(
+                "INSERT OR REPLACE INTO PointsHistory(email, ts, points, proxy_id) VALUES (?, ?, ?, ?)",
+                [(email, int(ts), int(points), proxy_ids.get(proxy)) for email, proxy, ts, points in rows]
+            )
 
-            await self.connection.commit()
+    async def _get_proxy_ids(self, cursor, proxies):
+        if missing := [proxy for proxy in proxies if proxy not in self.proxy_ids]:
+            await cursor.executemany("INSERT OR IGNORE INTO ProxyIds(proxy) VALUES(?)",
+                                     [(proxy,) for proxy in missing])
+            await cursor.execute(f"SELECT proxy, id FROM ProxyIds WHERE proxy IN "
+                                 f"({','.join('?' * len(missing))})", missing)
+            self.proxy_ids.update(await cursor.fetchall())
+
+        return {proxy: self.proxy_ids[proxy] for proxy in proxies}
+
+    async def rollup_points(self, now=None):
+        hour, day = 60 * 60, 24 * 60 * 60
+        now = int(now or time.time())
+        # polled samples reach the DB up to POINTS_FLUSH_INTERVAL late, an hour is final only after that
+        end_ts = (now - POINTS_FLUSH_INTERVAL) // hour * hour
+
+        async with self.transaction() as cursor:
+            await cursor.execute("SELECT MAX(start_ts) FROM PointsRollup WHERE period = ?", (hour,))
+            last_hour = (await cursor.fetchone())[0]
+
+            if last_hour is None:
+                await cursor.execute("SELECT MIN(ts) FROM PointsHistory")
+                first_ts = (await cursor.fetchone())[0]
+                if first_ts is None:
+                    return
+                start_ts = first_ts // hour * hour
+            else:
+                start_ts = last_hour + hour
+
+            if start_ts >= end_ts:
+                return
+
+            # earned points are the growth between neighbour samples, attributed to the later sample's proxy/hour.
+            # A day of lookback gives the first sample of the range its predecessor
+            await cursor.execute('''
+            INSERT OR REPLACE INTO PointsRollup(period, start_ts, email, proxy_id, earned, seconds)
+            SELECT ?, ts / ? * ?, email, IFNULL(proxy_id, 0), SUM(MAX(points - prev_points, 0)), SUM(ts - prev_ts)
+            FROM (
+                SELECT email, proxy_id, ts, points,
+                       LAG(points) OVER w AS prev_points, LAG(ts) OVER w AS prev_ts
+                FROM PointsHistory
+                WHERE ts >= ? AND ts < ?
+                WINDOW w AS (PARTITION BY email ORDER BY ts)
+            )
+            WHERE prev_ts IS NOT NULL AND ts >= ?
+            GROUP BY 2, 3, 4
+            ''', (hour, hour, hour, start_ts - day, end_ts, start_ts))
+
+            # days touched by the new hours are rebuilt from their hourly buckets
+            await cursor.execute('''
+            INSERT OR REPLACE INTO PointsRollup(period, start_ts, email, proxy_id, earned, seconds)
+            SELECT ?, start_ts / ? * ?, email, proxy_id, SUM(earned), SUM(seconds)
+            FROM PointsRollup
+            WHERE period = ? AND start_ts >= ?
+            GROUP BY 2, 3, 4
+            ''', (day, day, day, hour, start_ts // day * day))
+
+            await cursor.execute("DELETE FROM PointsHistory WHERE ts < ?",
+                                 (now - POINTS_HISTORY_RETENTION_DAYS * day,))
+            await cursor.execute("DELETE FROM PointsRollup WHERE period = ? AND start_ts < ?",
+                                 (hour, now - POINTS_HOURLY_RETENTION_DAYS * day))
+
+    async def get_points_rates(self, by="email", since_hours=24, period=60 * 60):
+        # points/hour per account (by="email") or per proxy (by="proxy") from rollups, no history scan
+        key = "r.email" if by == "email" else "p.proxy"
+
+        rows = await self.fetchall(f'''
+        SELECT {key}, SUM(r.earned) * 3600.0 / SUM(r.seconds)
+        FROM PointsRollup r LEFT JOIN ProxyIds p ON p.id = r.proxy_id
+        WHERE r.period = ? AND r.start_ts >= ?
+        GROUP BY {key}
+        HAVING SUM(r.seconds) > 0
+        ''', (period, int(time.time()) - since_hours * 60 * 60))
+
+        return dict(rows)
+
+    async def add_traffic(self, rows):
+        # rows: (day, proxy, email, channel, sent, received, requests), added to the stored counters
+        await self.executemany('''
+        INSERT INTO Traffic(day, proxy, email, channel, sent, received, requests) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(day, proxy, email, channel) DO UPDATE SET
+            sent = sent + excluded.sent,
+            received = received + excluded.received,
+            requests = requests + excluded.requests
+        ''', rows)
+
+    async def get_traffic_costs(self, days=1):
+        # (proxy, bytes, earned points) for the last days, most expensive per point first
+        day = 24 * 60 * 60
+        first_day = int(time.time()) // day - days + 1
+
+        return await self.fetchall('''
+        SELECT t.proxy, t.bytes, IFNULL(r.earned, 0)
+        FROM (SELECT proxy, SUM(sent + received) AS bytes FROM Traffic WHERE day >= ? GROUP BY proxy) t
+        LEFT JOIN (
+            SELECT p.proxy, SUM(r.earned) AS earned
+            FROM PointsRollup r JOIN ProxyIds p ON p.id = r.proxy_id
+            WHERE r.period = ? AND r.start_ts >= ?
+            GROUP BY p.proxy
+        ) r ON r.proxy = t.proxy
+        ORDER BY t.bytes * 1.0 / MAX(IFNULL(r.earned, 0), 1) DESC
+        ''', (first_day, day, first_day * day))
+
+    async def periodic_points_rollup(self):
+        while True:
+            await asyncio.sleep(POINTS_ROLLUP_INTERVAL)
+            try:
+                await self.rollup_points()
+            except Exception as e:
+                logger.error(f"Points rollup failed: {e}")
+
+    def track_points(self, email, points):
+        if not isinstance(points, (int, float)):
+            return
+
+        self.points_total += points - self.points_by_email.get(email, 0)
+        self.points_by_email[email] = points
 
     async def get_total_points(self):
-        async with self.db_lock:
-            await self.cursor.execute(
-                'SELECT SUM(CAST(points AS INTEGER)) '
-                'FROM (SELECT email, MAX(CAST(points AS INTEGER)) as points '
-                'FROM PointStats WHERE points NOT LIKE "%[^0-9]%" '
-                'GROUP BY email)'
-            )
-            result = await self.cursor.fetchone()
-            return result[0] if result else 0
+        return self.points_total
 
     async def get_proxies_by_email(self, email):
-        async with self.db_lock:
-            await self.cursor.execute("SELECT proxies FROM Accounts WHERE email=?", (email,))
-            row = await self.cursor.fetchone()
-        return row[0].split(",") if row else []
+        # a copy, callers build their own proxy rings out of it
+        if email in self.proxies_by_email or self.is_accounts_cached:
+            self.record_cache_lookup("accounts", True)
+            return list(self.proxies_by_email.get(email, ()))
+
+        self.record_cache_lookup("accounts", False)
+        row = await self.fetchone("SELECT proxies FROM Accounts WHERE email=?", (email,))
+        proxies = row[0].split(",") if row else []
+
+        if row:
+            self.cache_account(email, proxies)
+        return list(proxies)
+
+    async def get_proxy_score(self, proxy, ttl, ip=None):
+        row = await self.fetchone(
+            "SELECT score FROM ProxyScores WHERE (proxy = ? OR ip = ?) AND updated_at > ? "
+            "ORDER BY updated_at DESC LIMIT 1",
+            (proxy, ip, time.time() - ttl)
+        )
+        return row[0] if row else None
+
+    async def set_proxy_score(self, proxy, score, ip=None):
+        await self.execute("INSERT OR REPLACE INTO ProxyScores(proxy, ip, score, updated_at) "
+                           "VALUES(?, ?, ?, ?)", (proxy, ip, score, time.time()))
+
+    async def get_token(self, email, ttl):
+        return await self.fetchone("SELECT user_id, access_token FROM Tokens WHERE email = ? AND updated_at >= ?",
+                                   (email, time.time() - ttl))
+
+    async def set_token(self, email, user_id, access_token):
+        await self.execute("INSERT OR REPLACE INTO Tokens(email, user_id, access_token, updated_at) "
+                           "VALUES (?, ?, ?, ?)", (email, user_id, access_token, time.time()))
+
+    async def delete_token(self, email):
+        await self.execute("DELETE FROM Tokens WHERE email = ?", (email,))
+
+    async def get_proxy_latencies(self, max_age):
+        rows = await self.fetchall("SELECT proxy, director_rtt, api_rtt, is_healthy FROM ProxyLatency "
+                                   "WHERE measured_at > ?", (time.time() - max_age,))
+        return {row[0]: (row[1], row[2], bool(row[3])) for row in rows}
+
+    async def save_proxy_latencies(self, measurements):
+        measured_at = time.time()
+        await self.executemany(
+            "INSERT OR REPLACE INTO ProxyLatency(proxy, director_rtt, api_rtt, is_healthy, measured_at) "
+            "VALUES(?, ?, ?, ?, ?)",
+            [(proxy, director_rtt, api_rtt, int(is_healthy), measured_at)
+             for proxy, director_rtt, api_rtt, is_healthy in measurements]
+        )
+
+    async def reset_run_state(self):
+        # account/proxy bookkeeping is rebuilt from files on every start, measurements are kept between runs
+        async with self.transaction() as cursor:
+            for table in ("Accounts", "ProxyList", "PointStats"):
+                await cursor.execute(f"DELETE FROM {table}")
+
+        self.points_by_email.clear()
+        self.points_total = 0
+        self.proxies_by_email.clear()
+        self.email_by_proxy.clear()
+        self.is_accounts_cached = True
 
     async def push_extra_proxies(self, proxies):
-        async with self.db_lock:
-            await self.cursor.executemany("INSERT INTO ProxyList(proxy) VALUES(?)", [(proxy,) for proxy in proxies])
-            await self.connection.commit()
+        await self.executemany("INSERT INTO ProxyList(proxy) VALUES(?)", [(proxy,) for proxy in proxies])
+        self.extra_proxies_pushed += 1
+
+    async def delete_extra_proxies(self, proxies):
+        await self.executemany("DELETE FROM ProxyList WHERE proxy = ?", [(proxy,) for proxy in proxies])
+
+    async def count_extra_proxies(self, table="ProxyList"):
+        return (await self.fetchone(f"SELECT COUNT(*) FROM {table}"))[0]
+
+    async def remove_account(self, email):
+        # returns proxies the account held, so they can go back to the spares
+        proxies = await self.get_proxies_by_email(email)
+
+        await self.execute("DELETE FROM Accounts WHERE email=?", (email,))
+        self.cache_account(email, None)
+
+        return proxies
 
     async def delete_all_from_extra_proxies(self):
-        async with self.db_lock:
-            await self.cursor.execute("DELETE FROM ProxyList")
-            await self.connection.commit()
+        await self.execute("DELETE FROM ProxyList")
 
     async def close_connection(self):
         if self.clear_task:
             self.clear_task.cancel()
+        if self.rollup_task:
+            self.rollup_task.cancel()
+
+        await self.close_readers()
         await self.connection.close()
 
     async def get_new_from_extra_proxies(self, table="ProxyList"):
@@ -142,17 +514,15 @@ class AccountsDB:
         return proxy
 
     async def _fetch_and_validate_proxy(self, table):
+        # spares are handed out in push order (fastest first), each one is taken out of the table
+        # so accounts never race for the same proxy and the loop always ends
         while True:
-            proxy = await self._get_candidate_proxy(table)
+            proxy = await self._pop_candidate_proxy(table)
             if not proxy:
                 return None
 
             # Проверка, находится ли прокси в таблице BadProxies
-            async with self.db_lock:
-                await self.cursor.execute("SELECT proxy FROM BadProxies WHERE proxy = ?", (proxy,))
-                bad_proxy = await self.cursor.fetchone()
-
-            if bad_proxy:
+            if await self.is_bad_proxy(proxy):
                 logger.info(f"Proxy {proxy} is in bad proxies list. Skipping...")
                 continue
 
@@ -163,17 +533,32 @@ class AccountsDB:
                 return proxy
             else:
                 # Добавление прокси в таблицу BadProxies
-                async with self.db_lock:
-                    await self.cursor.execute("INSERT OR IGNORE INTO BadProxies(proxy) VALUES(?)", (proxy,))
-                    await self.connection.commit()
+                await self.execute("INSERT OR IGNORE INTO BadProxies(proxy) VALUES(?)", (proxy,))
+                if self.bad_proxies is not None:
+                    self.bad_proxies.add(proxy)
                 logger.warning(f"Proxy {proxy} failed validation. Adding to bad proxies list.")
 
+    async def is_bad_proxy(self, proxy):
+        if self.bad_proxies is not None:
+            self.record_cache_lookup("bad_proxies", True)
+            return proxy in self.bad_proxies
+
+        self.record_cache_lookup("bad_proxies", False)
+        self.bad_proxies = {row[0] for row in await self.fetchall("SELECT proxy FROM BadProxies")}
+        return proxy in self.bad_proxies
+
     async def _get_candidate_proxy(self, table):
-        async with self.db_lock:
-            await self.cursor.execute(f"SELECT proxy FROM {table} ORDER BY RANDOM() LIMIT 1")
-            result = await self.cursor.fetchone()
+        result = await self.fetchone(f"SELECT proxy FROM {table} ORDER BY RANDOM() LIMIT 1")
         return result[0] if result else None
 
+    async def _pop_candidate_proxy(self, table):
+        async with self.transaction() as cursor:
+            await cursor.execute(f"SELECT id, proxy FROM {table} ORDER BY id LIMIT 1")
+            result = await cursor.fetchone()
+            if result:
+                await cursor.execute(f"DELETE FROM {table} WHERE id = ?", (result[0],))
+        return result[1] if result else None
+
     async def _is_proxy_valid(self, proxy):
         try:
             async with aiohttp.ClientSession() as session:
@@ -207,27 +592,25 @@ class AccountsDB:
             return False
 
     async def _remove_valid_proxy(self, table, proxy):
-        async with self.db_lock:
-            await self.cursor.execute(f"DELETE FROM {table} WHERE proxy = ?", (proxy,))
-            await self.connection.commit()
+        await self.execute(f"DELETE FROM {table} WHERE proxy = ?", (proxy,))
 
     async def _remove_invalid_proxy(self, table, proxy):
-        async with self.db_lock:
-            await self.cursor.execute(f"DELETE FROM {table} WHERE proxy = ?", (proxy,))
-            await self.connection.commit()
+        await self.execute(f"DELETE FROM {table} WHERE proxy = ?", (proxy,))
 
     async def clear_bad_proxies_on_first_run(self):
         if AccountsDB.is_first_run:
-            async with self.db_lock:
-                await self.cursor.execute("DELETE FROM BadProxies")
-                await self.connection.commit()
+            await self.execute("DELETE FROM BadProxies")
+            self.bad_proxies = set()
             AccountsDB.is_first_run = False
             logger.info("BadProxies table cleared on first run")
 
     async def periodic_clear_bad_proxies(self):
         while True:
             await asyncio.sleep(self.clear_bad_proxies_interval * 60)
-            async with self.db_lock:
-                await self.cursor.execute("DELETE FROM BadProxies")
-                await self.connection.commit()
+            try:
+                await self.execute("DELETE FROM BadProxies")
+            except Exception as e:
+                logger.error(f"BadProxies clear failed: {e}")
+                continue
+            self.bad_proxies = set()
             logger.info("BadProxies table cleared periodically")
\ No newline at end of file
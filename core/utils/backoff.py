@@ -0,0 +1,46 @@
+import random
+from typing import Optional
+
+from core.utils import clock
+from core.utils.metrics import metrics
+from data.config import BACKOFF_POLICIES
+
+
+class BackoffPolicy:
+    def __init__(self, name: str, base: float, cap: float, jitter: float = 0.5, budget: Optional[int] = None):
+        self.name = name
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+        self.budget = budget
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.cap, self.base * 2 ** max(attempt - 1, 0))
+        return delay * (1 - self.jitter * random.random())
+
+    def next_delay(self, attempt: int) -> float:
+        metrics.mark("retry_attempts")
+        metrics.incr(f"retries_{self.name}")
+        return self.delay(attempt)
+
+    async def sleep(self, attempt: int):
+        await clock.sleep(self.next_delay(attempt))
+
+    # tenacity hooks, so decorators share the same timing as manual retry loops
+    def wait(self, retry_state) -> float:
+        return self.next_delay(retry_state.attempt_number)
+
+    def stop(self, retry_state) -> bool:
+        return self.budget is not None and retry_state.attempt_number >= self.budget
+
+    def retry_kwargs(self) -> dict:
+        return {"wait": self.wait, "stop": self.stop, "sleep": clock.sleep}
+
+
+policies = {}
+
+
+def backoff(name: str) -> BackoffPolicy:
+    if (policy := policies.get(name)) is None:
+        policy = policies[name] = BackoffPolicy(name, **BACKOFF_POLICIES[name])
+    return policy
@@ -0,0 +1,127 @@
+import asyncio
+from typing import Optional
+
+from core.utils import logger, clock
+from data.config import CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RECOVERY
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_BREAKER_FAILURES,
+                 recovery_time: float = CIRCUIT_BREAKER_RECOVERY):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.changed_at = 0.0
+        self.closed_event = asyncio.Event()
+        self.closed_event.set()
+
+    @property
+    def is_closed(self):
+        return self.state == self.CLOSED
+
+    def is_available(self) -> bool:
+        # same answer as allow() without taking the probe, for filtering candidates
+        return self.state == self.CLOSED or clock.monotonic() - self.changed_at >= self.recovery_time
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+
+        # only one caller gets through as a probe, the rest wait for its verdict.
+        # A probe that never reports back is replaced after another recovery period
+        if self.is_available():
+            self.set_state(self.HALF_OPEN)
+            logger.info(f"Circuit {self.name} is half-open. Probing...")
+            return True
+
+        return False
+
+    def record_success(self) -> bool:
+        self.failures = 0
+
+        if self.state == self.CLOSED:
+            return False
+
+        self.set_state(self.CLOSED)
+        logger.info(f"Circuit {self.name} is closed. Resuming...")
+        return True
+
+    def record_failure(self):
+        if self.state == self.HALF_OPEN:
+            self.trip()
+        elif self.state == self.CLOSED:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.trip()
+
+    def release_probe(self):
+        # the probe ended without a verdict on the host (a proxy error, a 4xx), the next caller probes right away
+        if self.state == self.HALF_OPEN:
+            self.changed_at = clock.monotonic() - self.recovery_time
+
+    def record(self, is_success: Optional[bool]):
+        # None - no verdict
+        if is_success:
+            self.record_success()
+        elif is_success is None:
+            self.release_probe()
+        else:
+            self.record_failure()
+
+    def trip(self):
+        self.failures = 0
+        self.set_state(self.OPEN)
+        logger.warning(f"Circuit {self.name} is open for {int(self.recovery_time)} seconds")
+
+    def set_state(self, state: str):
+        self.state = state
+        self.changed_at = clock.monotonic()
+
+        if state == self.CLOSED:
+            self.closed_event.set()
+        else:
+            self.closed_event.clear()
+
+    async def wait_allowed(self):
+        while not self.allow():
+            remaining = self.recovery_time - (clock.monotonic() - self.changed_at)
+            try:
+                await asyncio.wait_for(self.closed_event.wait(), timeout=max(remaining, 1))
+            except asyncio.TimeoutError:
+                pass
+
+
+class CircuitBreakers:
+    def __init__(self):
+        self.breakers = {}
+
+    def get(self, name: str, failure_threshold: int = CIRCUIT_BREAKER_FAILURES,
+            recovery_time: float = CIRCUIT_BREAKER_RECOVERY) -> CircuitBreaker:
+        if (breaker := self.breakers.get(name)) is None:
+            breaker = self.breakers[name] = CircuitBreaker(name, failure_threshold, recovery_time)
+        return breaker
+
+    def is_available(self, name: str) -> bool:
+        breaker = self.breakers.get(name)
+        return breaker is None or breaker.is_available()
+
+    def is_allowed(self, name: str) -> bool:
+        breaker = self.breakers.get(name)
+        return breaker is None or breaker.allow()
+
+    def record_success(self, name: str):
+        if (breaker := self.breakers.get(name)) is not None:
+            breaker.record_success()
+
+    def record_failure(self, name: str):
+        self.get(name).record_failure()
+
+
+circuit_breakers = CircuitBreakers()
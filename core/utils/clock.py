@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+
+class SystemClock:
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, delay: float):
+        await asyncio.sleep(delay)
+
+
+class VirtualClock(SystemClock):
+    # event loop time that jumps straight to the next timer whenever the loop would wait for it,
+    # so hours of sleeps, timeouts and backoffs pass in milliseconds. Only for loops without real network IO
+
+    def __init__(self, started_at: float = None):
+        self.started_at = time.time() if started_at is None else started_at
+        self.elapsed = 0.0
+
+    def time(self) -> float:
+        return self.started_at + self.elapsed
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.SelectorEventLoop()
+        loop.time = self.monotonic
+
+        # asyncio has no public hook for this: the loop passes the delay until its next timer to select()
+        selector = loop._selector
+        select = selector.select
+
+        def warped_select(timeout=None):
+            if timeout is not None and timeout > 0:
+                self.elapsed += timeout
+                timeout = 0
+            return select(timeout)
+
+        selector.select = warped_select
+        return loop
+
+    def run(self, coro):
+        loop = self.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+
+clock = SystemClock()
+
+
+def install(new_clock: SystemClock):
+    global clock
+    clock = new_clock
+
+
+def now() -> float:
+    return clock.time()
+
+
+def monotonic() -> float:
+    return clock.monotonic()
+
+
+async def sleep(delay: float):
+    await clock.sleep(delay)
@@ -1,8 +1,9 @@
-import asyncio
 import random
 from typing import Optional
 
-from core.utils import logger
+from core.utils import logger, clock
+from core.utils.backoff import backoff
+from core.utils.circuit_breaker import circuit_breakers
 from core.utils.exception import FailureLimitReachedException
 
 
@@ -11,7 +12,12 @@ def raise_error(error_type: Exception):
 
 
 class FailureCounter:
+    # attributes live in the slots of the concrete client (Grass)
+    __slots__ = ()
+
     global_fail_counter = {}
+    global_fail_amount = 0
+    site_breaker = circuit_breakers.get("site")
 
     def __init__(self):
         self.fail_count = 0
@@ -19,6 +25,7 @@ class FailureCounter:
         self.id = None
 
         self.limit = 5
+        self.limit_reached_count = 0
 
     def fail_increment(self, step: float = 1):
         self.fail_count += step
@@ -40,7 +47,8 @@ class FailureCounter:
             if is_raise:
                 raise_error(FailureLimitReachedException(self.fail_count))
             else:
-                sleep_time = random.randint(1, 3) * 60
+                self.limit_reached_count += 1
+                sleep_time = backoff("failure_limit").next_delay(self.limit_reached_count)
                 msg = f"{self.id} | Sleeping for {int(sleep_time)} seconds... Too many errors. Retrying..."
                 await self.reset_with_delay(msg, sleep_time)
         else:
@@ -55,28 +63,26 @@ class FailureCounter:
 
     async def delay_with_log(self, msg: str, sleep_time: int = random.randint(5, 10) * 60):
         logger.info(msg)
-        await asyncio.sleep(sleep_time)
+        await clock.sleep(sleep_time)
 
     def log_global_count(self, is_work: bool = False):
+        was_failed = FailureCounter.global_fail_counter.get(self.id) == 0
         FailureCounter.global_fail_counter[self.id] = int(is_work)
+        FailureCounter.global_fail_amount += int(not is_work) - int(was_failed)
 
     @staticmethod
-    async def clear_global_counter():
-        await asyncio.sleep(10 * 60)
-
-        FailureCounter.global_fail_counter = {x: 1 for x in FailureCounter.global_fail_counter}
+    def clear_global_counter():
+        FailureCounter.global_fail_counter = dict.fromkeys(FailureCounter.global_fail_counter, 1)
+        FailureCounter.global_fail_amount = 0
 
     @staticmethod
     def is_global_error(min_limit: int = 10):
         amount = len(FailureCounter.global_fail_counter)
-        work_count = sum(FailureCounter.global_fail_counter.values())
-        fail_count = amount - work_count
+        fail_count = FailureCounter.global_fail_amount
 
         limit_fail_amount = amount * 0.30
 
         if limit_fail_amount < min_limit:
             limit_fail_amount = min(amount, min_limit)
 
-        if fail_count > limit_fail_amount:
-            asyncio.create_task(FailureCounter.clear_global_counter())
-            return True
+        return fail_count > limit_fail_amount
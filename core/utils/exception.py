@@ -5,6 +5,10 @@ class WebsocketClosedException(Exception):
     pass
 
 
+class WebsocketStaleException(Exception):
+    pass
+
+
 class ProxyError(Exception):
     pass
 
@@ -25,10 +29,18 @@ class ConnectionException(aiohttp.ClientConnectionError):
     pass
 
 
+class ClaimRefusedException(aiohttp.ClientError):
+    pass
+
+
 class LoginException(Exception):
     pass
 
 
+class TokenExpiredException(Exception):
+    pass
+
+
 class WebsocketConnectionFailedError(Exception):
     pass
 
@@ -0,0 +1,106 @@
+import asyncio
+from collections import deque
+from typing import Dict, Optional
+
+from core.utils import logger, clock
+from core.utils.metrics import metrics
+from data.config import JOB_CONCURRENCY_INITIAL, JOB_CONCURRENCY_MAX, JOB_LATENCY_TARGET, JOB_QUEUE_LIMIT, \
+    JOB_QUEUE_TIMEOUT
+
+
+class AimdLimiter:
+    # concurrent HTTP_REQUEST jobs through one proxy: the limit grows by one per `limit` fast successes
+    # (additive increase) and is halved by an error or a slow answer, at most once per JOB_LATENCY_TARGET
+    # (multiplicative decrease).
+    # Jobs over the limit wait in a bounded queue for a bounded time
+
+    def __init__(self, initial: float = JOB_CONCURRENCY_INITIAL, maximum: float = JOB_CONCURRENCY_MAX,
+                 latency_target: float = JOB_LATENCY_TARGET, queue_limit: int = JOB_QUEUE_LIMIT,
+                 queue_timeout: float = JOB_QUEUE_TIMEOUT):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.waiters = deque()
+        self.decreased_at = float("-inf")
+
+    @property
+    def queued(self) -> int:
+        return len(self.waiters)
+
+    async def acquire(self) -> bool:
+        # False if the queue is full or the wait timed out, the job is refused then
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return True
+
+        if len(self.waiters) >= self.queue_limit:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+
+        try:
+            # a released slot is handed over to the waiter, in_flight is already counted for it
+            return await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over right before the cancel, it goes to the next waiter
+                self.in_flight -= 1
+                self.wake()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self, latency: float, is_success: Optional[bool]):
+        # is_success None - the job was cancelled, it says nothing about the proxy
+        self.in_flight -= 1
+
+        if is_success and latency <= self.latency_target:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif is_success is not None and (now := clock.monotonic()) - self.decreased_at >= self.latency_target:
+            # jobs failing together hit one overload, the limit is halved once per latency window for it
+            self.limit = max(1.0, self.limit / 2)
+            self.decreased_at = now
+
+        self.wake()
+
+    def wake(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+
+class JobLimiters:
+    def __init__(self):
+        self.limiters: Dict[str, AimdLimiter] = {}
+
+    def get(self, proxy: str) -> AimdLimiter:
+        if (limiter := self.limiters.get(proxy)) is None:
+            limiter = self.limiters[proxy] = AimdLimiter()
+        return limiter
+
+    def report(self, top: int = 5) -> str:
+        metrics.gauge("jobs_in_flight", sum(limiter.in_flight for limiter in self.limiters.values()))
+        metrics.gauge("jobs_queued", sum(limiter.queued for limiter in self.limiters.values()))
+
+        busiest = sorted(self.limiters.items(), key=lambda item: (item[1].queued, item[1].in_flight), reverse=True)
+        return " | ".join(f"{proxy} limit={limiter.limit:.1f} in_flight={limiter.in_flight} queued={limiter.queued}"
+                          for proxy, limiter in busiest[:top] if limiter.in_flight or limiter.queued)
+
+    async def log_periodically(self, interval: int):
+        while True:
+            await clock.sleep(interval)
+            if report := self.report():
+                logger.info(f"Jobs | {report}")
+
+
+job_limiters = JobLimiters()
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+from curl_cffi import CurlHttpVersion, CurlInfo
+from curl_cffi.requests import AsyncSession, Cookies, Response
+
+from core.utils import logger, clock
+from core.utils.metrics import metrics
+from data.config import JOB_SESSIONS_LIMIT, JOB_SESSION_CONNECTIONS, JOB_SESSION_IDLE_TTL
+
+
+class NoCookies(Cookies):
+    # jobs are independent requests and a pooled session serves several of them at once, so target answers
+    # never fill the session jar. Set-Cookie still reaches the job result with the response headers
+    def update_cookies_from_curl(self, morsels):
+        pass
+
+
+class JobSession(AsyncSession):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # curl_cffi has no option to turn the session jar off
+        self._cookies = NoCookies()
+
+
+class PooledSession:
+    __slots__ = ("session", "last_used", "in_use")
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.last_used = clock.monotonic()
+        self.in_use = 0
+
+
+class JobSessions:
+    # HTTP_REQUEST jobs through one proxy to one origin share a session, so its connections (HTTP/2 where
+    # the target supports it) stay alive between jobs instead of a new CONNECT and TLS handshake per job.
+    # Sessions idle for JOB_SESSION_IDLE_TTL are closed, a new one over JOB_SESSIONS_LIMIT replaces the least recently
+    # used idle session
+
+    def __init__(self, limit: int = JOB_SESSIONS_LIMIT, connections: int = JOB_SESSION_CONNECTIONS,
+                 idle_ttl: float = JOB_SESSION_IDLE_TTL):
+        self.limit = limit
+        self.connections = connections
+        self.idle_ttl = idle_ttl
+        self.sessions: "OrderedDict[Tuple[Optional[str], str], PooledSession]" = OrderedDict()
+
+    def create_session(self, proxy: Optional[str]) -> AsyncSession:
+        return JobSession(
+            proxies={'http': proxy, 'https': proxy} if proxy else None,
+            impersonate="chrome",
+            verify=False,
+            max_clients=self.connections,
+            http_version=CurlHttpVersion.V2TLS,
+            curl_infos=[CurlInfo.NUM_CONNECTS],
+        )
+
+    async def request(self, proxy: Optional[str], method: str, url: str, **kwargs) -> Response:
+        parts = urlsplit(url)
+        key = (proxy, f"{parts.scheme}://{parts.netloc}")
+
+        await self.evict_idle()
+
+        # another job may have opened the session while room was being made
+        pooled = self.sessions.get(key)
+        if pooled is None and await self.make_room() and (pooled := self.sessions.get(key)) is None:
+            pooled = self.sessions[key] = PooledSession(self.create_session(proxy))
+            metrics.incr("job_sessions_created")
+
+        if pooled is None:
+            # every pooled session is busy, the job gets a session of its own
+            session = self.create_session(proxy)
+            try:
+                return await self.perform(session, method, url, **kwargs)
+            finally:
+                await session.close()
+
+        self.sessions.move_to_end(key)
+        pooled.in_use += 1
+        try:
+            return await self.perform(pooled.session, method, url, **kwargs)
+        finally:
+            pooled.in_use -= 1
+            pooled.last_used = clock.monotonic()
+
+    @staticmethod
+    async def perform(session: AsyncSession, method: str, url: str, **kwargs) -> Response:
+        started_at = clock.monotonic()
+        response = await session.request(method, url, **kwargs)
+
+        is_reused = not response.infos.get(CurlInfo.NUM_CONNECTS)
+        metrics.incr("job_connections_reused" if is_reused else "job_connections_new")
+        metrics.observe("job_latency_reused" if is_reused else "job_latency_new", clock.monotonic() - started_at)
+        return response
+
+    async def evict_idle(self):
+        # the least recently used sessions come first
+        border = clock.monotonic() - self.idle_ttl
+        idle = []
+        for key, pooled in self.sessions.items():
+            if pooled.last_used >= border:
+                break
+            if not pooled.in_use:
+                idle.append(key)
+
+        for key in idle:
+            await self.evict(key)
+
+    async def make_room(self) -> bool:
+        if len(self.sessions) < self.limit:
+            return True
+
+        if (key := next((key for key, pooled in self.sessions.items() if not pooled.in_use), None)) is None:
+            return False
+
+        await self.evict(key)
+        return True
+
+    async def evict(self, key: Tuple[Optional[str], str]):
+        if (pooled := self.sessions.pop(key, None)) is None:
+            return
+
+        metrics.incr("job_sessions_evicted")
+        try:
+            await pooled.session.close()
+        except Exception as e:
+            logger.debug(f"Job session {key[1]} close failed: {e}")
+
+    async def close(self):
+        for key in list(self.sessions):
+            await self.evict(key)
+
+
+job_sessions = JobSessions()
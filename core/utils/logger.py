@@ -1,78 +1,92 @@
 import sys
 import re
+from collections import deque
 from datetime import date
 from loguru import logger
 
+from data.config import LOG_GUI_MAX_LINES, LOG_GUI_BUFFER_SIZE, LOG_GUI_FLUSH_INTERVAL
+
 # Only import Qt components if not running in container
 try:
     from PySide6.QtWidgets import QTextEdit
-    from PySide6.QtGui import QColor
-    from PySide6.QtCore import QObject, Signal, Slot
+    from PySide6.QtGui import QColor, QTextCharFormat, QTextCursor
+    from PySide6.QtCore import QTimer, Slot
     QT_AVAILABLE = True
 except ImportError:
     QT_AVAILABLE = False
 
 # Rest of the code wrapped in appropriate checks
 if QT_AVAILABLE:
-    class LogSignals(QObject):
-        new_log = Signal(str, dict)
-    
+    # time, level and message colors by log level, anything else gets the DEBUG ones
+    LEVEL_COLORS = {
+        "ERROR": ("#00FF00", "#FF0000", "#FF0000"),  # green, red, red
+        "WARNING": ("#27e868", "#FFD700", "#FFD700"),  # green, yellow, yellow
+        "INFO": ("#27e868", "#32c2c2", "#FFFFFF"),  # green, blue, white
+        "DEBUG": ("#27e868", "#d137d4", "#eb811e"),  # green, purple, orange
+    }
+
+    def char_formats(colors):
+        formats = []
+        for color in colors:
+            text_format = QTextCharFormat()
+            text_format.setForeground(QColor(color))
+            formats.append(text_format)
+        return tuple(formats)
+
     class QTextEditHandler:
-        def __init__(self, text_edit: QTextEdit):
-            self.text_edit = text_edit
-            self.signals = LogSignals()
-            self.signals.new_log.connect(self.append_message)
+        """
+        Loguru sink rendering into a QTextEdit in batches.
 
-        def write(self, message: str):
-            clean_message = clean_brackets(message)
-            
-            # Define colors based on logging level
-            if "ERROR" in message:
-                colors = {
-                    "time": QColor("#00FF00"),  # green
-                    "level": QColor("#FF0000"),  # red
-                    "message": QColor("#FF0000")  # red
-                }
-            elif "WARNING" in message:
-                colors = {
-                    "time": QColor("#27e868"),  # green
-                    "level": QColor("#FFD700"),  # yellow
-                    "message": QColor("#FFD700")  # yellow
-                }
-            elif "INFO" in message:
-                colors = {
-                    "time": QColor("#27e868"),  # green
-                    "level": QColor("#32c2c2"),  # blue
-                    "message": QColor("#FFFFFF")  # white
-                }
-            else:
-                colors = {
-                    "time": QColor("#27e868"),  # green
-                    "level": QColor("#d137d4"),  # blue
-                    "message": QColor("#eb811e")  # orange
-                }
-            
-            # Send signal to update UI
-            self.signals.new_log.emit(clean_message, colors)
+        Lines from any thread go into a ring buffer, a timer in the GUI thread renders them as one edit
+        and the document keeps only the last LOG_GUI_MAX_LINES lines.
+        """
 
-        @Slot(str, dict)
-        def append_message(self, message: str, colors: dict):
-            # Split message into parts
-            parts = message.split(" ", 2)
-            if len(parts) >= 3:
-                time_part, level_part, message_part = parts
+        def __init__(self, text_edit: QTextEdit, max_lines: int = LOG_GUI_MAX_LINES,
+                     buffer_size: int = LOG_GUI_BUFFER_SIZE, flush_interval: int = LOG_GUI_FLUSH_INTERVAL):
+            self.text_edit = text_edit
+            self.text_edit.document().setMaximumBlockCount(max_lines)
+            self.formats = {level: char_formats(colors) for level, colors in LEVEL_COLORS.items()}
 
-                # Add timestamp
-                self.text_edit.setTextColor(colors["time"])
-                self.text_edit.insertPlainText(time_part + " ")
+            self.buffer = deque(maxlen=buffer_size)
+            self.dropped = 0
 
-                # Add log level
-                self.text_edit.setTextColor(colors["level"])
-                self.text_edit.insertPlainText(level_part + " ")
+            self.timer = QTimer(text_edit)
+            self.timer.timeout.connect(self.render)
+            self.timer.start(flush_interval)
 
-                # Add message content
-                self.text_edit.setTextColor(colors["message"])
-                self.text_edit.insertPlainText(message_part + "\n")
+        def write(self, message: str):
+            if len(self.buffer) == self.buffer.maxlen:
+                # the oldest line is pushed out, the GUI couldn't keep up
+                self.dropped += 1
+            self.buffer.append(clean_brackets(message).rstrip("\n"))
+
+        # not `flush`: loguru calls a sink's flush after every message
+        @Slot()
+        def render(self):
+            if not self.buffer:
+                return
+
+            lines = [self.buffer.popleft() for _ in range(len(self.buffer))]
+            if self.dropped:
+                lines.insert(0, f"-- WARNING {self.dropped} log lines skipped")
+                self.dropped = 0
+
+            cursor = QTextCursor(self.text_edit.document())
+            cursor.movePosition(QTextCursor.MoveOperation.End)
+            cursor.beginEditBlock()
+
+            for line in lines:
+                parts = line.split(" ", 2)
+                if len(parts) < 3:
+                    continue
+
+                if not cursor.atBlockStart():
+                    cursor.insertBlock()
+                for part, separator, text_format in zip(parts, (" ", " ", ""),
+                                                        self.formats.get(parts[1], self.formats["DEBUG"])):
+                    cursor.insertText(part + separator, text_format)
+
+            cursor.endEditBlock()
 
             # Scroll to bottom
             scrollbar = self.text_edit.verticalScrollBar()
@@ -126,9 +140,6 @@ if QT_AVAILABLE:
     logging_setup(gui_mode=False)
 else:
     # Dummy classes for non-GUI environment
-    class LogSignals:
-        pass
-    
     class QTextEditHandler:
         def __init__(self, *args, **kwargs):
             pass
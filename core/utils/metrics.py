@@ -0,0 +1,65 @@
+from collections import defaultdict, deque
+
+from core.utils import logger, clock
+
+
+class Metrics:
+    def __init__(self, samples_limit: int = 1000):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.samples = defaultdict(lambda: deque(maxlen=samples_limit))
+        self.events = defaultdict(deque)
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def mark(self, name: str, window: int = 60):
+        events = self.events[name]
+        events.append(clock.monotonic())
+        self.prune(events, window)
+
+    def rate(self, name: str, window: int = 60) -> int:
+        events = self.events.get(name)
+        if not events:
+            return 0
+        self.prune(events, window)
+        return len(events)
+
+    @staticmethod
+    def prune(events: deque, window: int):
+        border = clock.monotonic() - window
+        while events and events[0] < border:
+            events.popleft()
+
+    def gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        self.samples[name].append(value)
+
+    def percentile(self, name: str, q: float):
+        values = sorted(self.samples.get(name, ()))
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    def summary(self) -> str:
+        parts = [f"{name}={value}" for name, value in sorted(self.counters.items())]
+        parts += [f"{name}={value:g}" for name, value in sorted(self.gauges.items())]
+        parts += [f"{name}/min={self.rate(name)}" for name in sorted(self.events)]
+
+        for name, values in sorted(self.samples.items()):
+            if values:
+                parts.append(f"{name}(n={len(values)} p50={self.percentile(name, 0.5):.2f} "
+                             f"p95={self.percentile(name, 0.95):.2f})")
+
+        return " | ".join(parts)
+
+    async def log_periodically(self, interval: int):
+        while True:
+            await clock.sleep(interval)
+            if summary := self.summary():
+                logger.info(f"Metrics | {summary}")
+
+
+metrics = Metrics()
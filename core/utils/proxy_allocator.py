@@ -0,0 +1,118 @@
+import asyncio
+from collections import defaultdict, deque
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+from core.utils import logger, clock
+from core.utils.metrics import metrics
+from core.utils.proxy_ring import get_proxy_health
+from data.config import ALLOCATOR_SCARCE_BELOW, ALLOCATOR_WINDOW, ALLOCATOR_BURN_WINDOW, ALLOCATOR_RATES_TTL
+
+
+class ProxyAllocator:
+    # while spares are plenty they go to whoever asks. When fewer are left, requests gathered over a short window
+    # are served by expected yield: points/hour of the account divided by the spares it burned recently,
+    # and the healthiest of the popped spares go to the highest yield accounts
+
+    def __init__(self, scarce_below: int = ALLOCATOR_SCARCE_BELOW, window: float = ALLOCATOR_WINDOW,
+                 burn_window: float = ALLOCATOR_BURN_WINDOW, rates_ttl: float = ALLOCATOR_RATES_TTL):
+        self.scarce_below = scarce_below
+        self.window = window
+        self.burn_window = burn_window
+        self.rates_ttl = rates_ttl
+
+        self.db = None
+        self.rates: Dict[str, float] = {}
+        self.default_rate = 0.0
+        self.rates_loaded_at: Optional[float] = None
+        self.burned: Dict[str, deque] = defaultdict(deque)
+        self.waiting: List[Tuple[str, asyncio.Future]] = []
+        self.task: Optional[asyncio.Task] = None
+
+    async def acquire(self, db, email: str) -> Optional[str]:
+        self.db = db
+
+        if not self.scarce_below or await db.count_extra_proxies() >= self.scarce_below:
+            if (proxy := await db.get_new_from_extra_proxies("ProxyList")) is not None:
+                self.record_grant(email)
+            return proxy
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append((email, future))
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.allocate())
+
+        return await future
+
+    async def allocate(self):
+        try:
+            # requests coming while a round is served wait for the next round of the same task
+            while self.waiting:
+                await clock.sleep(self.window)
+                count = len(self.waiting)
+                await self.allocate_round([(email, future) for email, future in self.waiting[:count]
+                                           if not future.done()])
+                del self.waiting[:count]
+        finally:
+            # cancelled, nobody else would answer the accounts still waiting
+            for _, future in self.waiting:
+                if not future.done():
+                    future.set_result(None)
+            self.waiting = []
+
+    async def allocate_round(self, waiting: List[Tuple[str, asyncio.Future]]):
+        try:
+            await self.load_rates()
+            waiting.sort(key=lambda item: self.priority(item[0]), reverse=True)
+
+            spares = []
+            for _ in waiting:
+                if (proxy := await self.db.get_new_from_extra_proxies("ProxyList")) is None:
+                    break
+                spares.append(proxy)
+            spares.sort(key=lambda proxy: get_proxy_health(proxy).weight, reverse=True)
+        except Exception as e:
+            logger.error(f"Spare proxies allocation failed: {e}")
+            spares = []
+
+        for (email, future), proxy in zip(waiting, spares + [None] * (len(waiting) - len(spares))):
+            if future.done():
+                # the account stopped waiting, its spare goes back
+                if proxy is not None:
+                    await self.db.push_extra_proxies([proxy])
+                continue
+
+            if proxy is not None:
+                self.record_grant(email)
+            future.set_result(proxy)
+
+        metrics.incr("scarce_spares_granted", len(spares))
+        metrics.incr("scarce_spares_denied", len(waiting) - len(spares))
+        logger.info(f"Allocated {len(spares)} scarce spare proxies to {len(waiting)} waiting accounts by yield")
+
+    async def load_rates(self):
+        now = clock.monotonic()
+        if self.rates_loaded_at is not None and now - self.rates_loaded_at < self.rates_ttl:
+            return
+
+        self.rates = await self.db.get_points_rates(by="email")
+        # accounts without history yet rank as a typical one instead of the last
+        self.default_rate = median(self.rates.values()) if self.rates else 0.0
+        self.rates_loaded_at = now
+
+    def priority(self, email: str) -> float:
+        return self.rates.get(email, self.default_rate) / (1 + self.burn_count(email))
+
+    def burn_count(self, email: str) -> int:
+        grants = self.burned[email]
+        border = clock.monotonic() - self.burn_window
+        while grants and grants[0] < border:
+            grants.popleft()
+        return len(grants)
+
+    def record_grant(self, email: str):
+        self.burned[email].append(clock.monotonic())
+
+
+proxy_allocator = ProxyAllocator()
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import List, Optional
+
+import aiohttp
+
+from core.utils import logger
+from core.utils.proxy_ring import get_proxy_health
+from data.config import PROXY_PROBE_CONCURRENCY, PROXY_PROBE_TIMEOUT, PROXY_PROBE_MAX_AGE
+
+PROBE_URLS = ("https://director.getgrass.io/", "https://api.getgrass.io/")
+
+
+async def on_connection_create_start(session, context: SimpleNamespace, params):
+    context.trace_request_ctx["connect_started_at"] = time.monotonic()
+
+
+async def on_connection_create_end(session, context: SimpleNamespace, params):
+    context.trace_request_ctx["connect_time"] = time.monotonic() - context.trace_request_ctx["connect_started_at"]
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+
+async def measure_rtt(session: aiohttp.ClientSession, url: str, proxy: str) -> Optional[float]:
+    # connection creation covers TCP connect, proxy CONNECT and TLS handshake - the part a proxy is responsible for
+    trace_ctx = {}
+    started_at = time.monotonic()
+
+    try:
+        async with session.head(url, proxy=proxy, allow_redirects=False, trace_request_ctx=trace_ctx,
+                                timeout=aiohttp.ClientTimeout(total=PROXY_PROBE_TIMEOUT)):
+            pass
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
+
+    return trace_ctx.get("connect_time", time.monotonic() - started_at)
+
+
+async def probe_proxy(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, proxy: str) -> tuple:
+    async with semaphore:
+        director_rtt, api_rtt = await asyncio.gather(*(measure_rtt(session, url, proxy) for url in PROBE_URLS))
+
+    return proxy, director_rtt, api_rtt, director_rtt is not None and api_rtt is not None
+
+
+async def probe_proxies(proxies: List[str]) -> List[tuple]:
+    semaphore = asyncio.Semaphore(PROXY_PROBE_CONCURRENCY)
+    connector = aiohttp.TCPConnector(ssl=False, force_close=True, limit=PROXY_PROBE_CONCURRENCY * len(PROBE_URLS))
+
+    async with aiohttp.ClientSession(connector=connector, trace_configs=[create_trace_config()]) as session:
+        return await asyncio.gather(*(probe_proxy(session, semaphore, proxy) for proxy in proxies))
+
+
+async def rank_proxies(proxies: List[str], db) -> List[str]:
+    measurements = await db.get_proxy_latencies(PROXY_PROBE_MAX_AGE)
+
+    if to_probe := [proxy for proxy in dict.fromkeys(proxies) if proxy not in measurements]:
+        logger.info(f"Probing {len(to_probe)} proxies...")
+        results = await probe_proxies(to_probe)
+        await db.save_proxy_latencies(results)
+        measurements.update({proxy: (director_rtt, api_rtt, is_healthy)
+                             for proxy, director_rtt, api_rtt, is_healthy in results})
+
+    for proxy in dict.fromkeys(proxies):
+        director_rtt, api_rtt, is_healthy = measurements[proxy]
+        if is_healthy:
+            get_proxy_health(proxy).latency = director_rtt + api_rtt
+
+    healthy = sorted((proxy for proxy in proxies if measurements[proxy][2]),
+                     key=lambda proxy: measurements[proxy][0] + measurements[proxy][1])
+    unhealthy = [proxy for proxy in proxies if not measurements[proxy][2]]
+
+    logger.info(f"Proxies ranked by latency: {len(healthy)} healthy, {len(unhealthy)} failed probing")
+
+    return healthy + unhealthy
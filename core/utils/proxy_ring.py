@@ -0,0 +1,113 @@
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional
+
+
+class ProxyHealth:
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.latency: Optional[float] = None
+        self.score: Optional[int] = None
+
+    def record_success(self, latency: float = None):
+        self.successes += 1
+        if latency is not None:
+            self.latency = latency if self.latency is None else self.latency * 0.7 + latency * 0.3
+
+    def record_failure(self):
+        self.failures += 1
+
+    @property
+    def success_rate(self) -> float:
+        # smoothed, so an unknown proxy starts at 0.5 instead of 0 or 1
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    @property
+    def weight(self) -> float:
+        score = self.score if self.score is not None else 75
+        latency = self.latency if self.latency is not None else 1.0
+        return self.success_rate * score / (1 + latency)
+
+
+proxy_health: Dict[str, ProxyHealth] = {}
+
+
+def get_proxy_health(proxy: str) -> ProxyHealth:
+    if (health := proxy_health.get(proxy)) is None:
+        health = proxy_health[proxy] = ProxyHealth()
+    return health
+
+
+class ProxyRing:
+    def __init__(self, proxies: Iterable[str] = (), lookahead: int = 8):
+        self.ring = deque()
+        self.members = set()
+        self.lookahead = lookahead
+        # the proxy handed out last, usually the one that just failed
+        self.last: Optional[str] = None
+
+        for proxy in proxies:
+            self.add(proxy)
+
+    def __len__(self):
+        return len(self.ring)
+
+    def __contains__(self, proxy: str):
+        return proxy in self.members
+
+    def __iter__(self):
+        return iter(self.ring)
+
+    def add(self, proxy: str, front: bool = False) -> bool:
+        if proxy in self.members:
+            return False
+
+        self.members.add(proxy)
+        if front:
+            self.ring.appendleft(proxy)
+        else:
+            self.ring.append(proxy)
+        return True
+
+    def remove(self, proxy: str):
+        if proxy in self.members:
+            self.members.discard(proxy)
+            self.ring.remove(proxy)
+
+    def next(self, is_allowed: Callable[[str], bool] = None) -> Optional[str]:
+        # the healthiest allowed proxy among the first `lookahead` ones goes to the tail. The last handed out
+        # proxy is skipped unless nothing else is allowed: its weight may still be the best right after it failed
+        is_allowed = is_allowed or (lambda proxy: True)
+
+        if (proxy := self.next_of(lambda proxy: proxy != self.last and is_allowed(proxy))) is not None:
+            return proxy
+        if self.last in self.members and is_allowed(self.last):
+            return self.take(self.ring.index(self.last))
+        return self.take(0) if self.ring else None
+
+    def next_of(self, is_allowed: Callable[[str], bool]) -> Optional[str]:
+        for _ in range(0, len(self.ring), self.lookahead):
+            window = min(self.lookahead, len(self.ring))
+            best_index, best_weight = None, -1.0
+
+            for index in range(window):
+                proxy = self.ring[index]
+                if not is_allowed(proxy):
+                    continue
+                if (weight := get_proxy_health(proxy).weight) > best_weight:
+                    best_index, best_weight = index, weight
+
+            if best_index is not None:
+                return self.take(best_index)
+
+            self.ring.rotate(-window)
+
+        return None
+
+    def take(self, index: int) -> str:
+        self.ring.rotate(-index)
+        proxy = self.ring.popleft()
+        self.ring.rotate(index)
+        self.ring.append(proxy)
+        self.last = proxy
+        return proxy
@@ -0,0 +1,25 @@
+from core.utils import clock
+
+
+class RateLimiter:
+    # token bucket: `rate` acquisitions per second on average, up to `burst` at once after a pause
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = clock.monotonic()
+
+    def refill(self):
+        now = clock.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        # the token is reserved right away, a caller in debt sleeps until the bucket would have refilled it.
+        # Callers are served in order without a lock and without re-checking the bucket after sleeping
+        self.refill()
+        self.tokens -= 1
+
+        if self.tokens < 0:
+            await clock.sleep(-self.tokens / self.rate)
@@ -1,26 +1,59 @@
+from types import MappingProxyType
+from typing import Optional
+
+import aiohttp
+
+# shared by every client, each instance only keeps its own user agent and access token
+WEBSITE_HEADERS = MappingProxyType({
+    'authority': 'api.getgrass.io',
+    'accept': 'application/json, text/plain, */*',
+    'accept-language': 'uk-UA,uk;q=0.9,en-US;q=0.8,en;q=0.7',
+    'content-type': 'application/json',
+    'origin': 'https://app.getgrass.io',
+    'referer': 'https://app.getgrass.io/',
+    'sec-ch-ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-site',
+})
+
+shared_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_shared_session() -> aiohttp.ClientSession:
+    # one session and connector for all accounts: proxy is chosen per request and auth is a header,
+    # so accounts need no cookies of their own
+    global shared_session
+
+    if shared_session is None or shared_session.closed:
+        shared_session = aiohttp.ClientSession(trust_env=True, cookie_jar=aiohttp.DummyCookieJar(),
+                                               connector=aiohttp.TCPConnector(ssl=False, limit=0))
+    return shared_session
+
+
+async def close_shared_session():
+    if shared_session is not None:
+        await shared_session.close()
+
 
 class BaseClient:
+    __slots__ = ("session", "ip", "ip_proxy", "username", "proxy", "user_agent", "access_token")
+
     def __init__(self, user_agent: str, proxy: str = None):
         self.session = None
         self.ip = None
+        self.ip_proxy = None
         self.username = None
-        self.proxy = None
+        self.access_token: Optional[str] = None
 
         self.user_agent = user_agent
         self.proxy = proxy
 
-        self.website_headers = {
-            'authority': 'api.getgrass.io',
-            'accept': 'application/json, text/plain, */*',
-            'accept-language': 'uk-UA,uk;q=0.9,en-US;q=0.8,en;q=0.7',
-            'content-type': 'application/json',
-            'origin': 'https://app.getgrass.io',
-            'referer': 'https://app.getgrass.io/',
-            'sec-ch-ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-            'sec-fetch-dest': 'empty',
-            'sec-fetch-mode': 'cors',
-            'sec-fetch-site': 'same-site',
-            'user-agent': self.user_agent,
-        }
+    @property
+    def website_headers(self) -> dict:
+        headers = {**WEBSITE_HEADERS, 'user-agent': self.user_agent}
+        if self.access_token:
+            headers['Authorization'] = self.access_token
+        return headers
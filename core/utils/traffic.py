@@ -0,0 +1,55 @@
+from collections import defaultdict
+
+from core.utils import logger, clock
+
+
+def headers_size(headers) -> int:
+    # "name: value\r\n" per header, works for dicts and aiohttp raw (bytes) header pairs
+    items = headers.items() if hasattr(headers, "items") else headers
+    return sum(len(name) + len(value) + 4 for name, value in items)
+
+
+class TrafficMeter:
+    # channels: "rest" api calls, "ws" websocket frames, "checkin" director check-ins, "job" HTTP_REQUEST jobs
+
+    def __init__(self):
+        # (proxy, email, channel) -> [sent bytes, received bytes, requests]
+        self.counters = defaultdict(lambda: [0, 0, 0])
+
+    def record(self, proxy: str, email: str, channel: str, sent: int = 0, received: int = 0, requests: int = 1):
+        counter = self.counters[(proxy or "", email or "", channel)]
+        counter[0] += sent
+        counter[1] += received
+        counter[2] += requests
+
+    def drain(self) -> list:
+        counters, self.counters = self.counters, defaultdict(lambda: [0, 0, 0])
+        day = int(clock.now()) // (24 * 60 * 60)
+        return [(day, proxy, email, channel, *counter) for (proxy, email, channel), counter in counters.items()]
+
+    async def flush(self, db):
+        if not (rows := self.drain()):
+            return
+
+        try:
+            await db.add_traffic(rows)
+        except Exception:
+            # the drained counters go back and are written by the next flush
+            for _day, proxy, email, channel, sent, received, requests in rows:
+                self.record(proxy, email, channel, sent, received, requests)
+            raise
+
+    async def flush_periodically(self, db, interval: int, report_top: int = 3):
+        while True:
+            await clock.sleep(interval)
+            try:
+                await self.flush(db)
+
+                for proxy, traffic, points in (await db.get_traffic_costs())[:report_top]:
+                    per_point = f"{traffic / points / 1024:.1f} KB/point" if points else "no points"
+                    logger.info(f"Traffic | {proxy or 'direct'} | {traffic / 1024 ** 2:.1f} MB today | {per_point}")
+            except Exception as e:
+                logger.error(f"Traffic flush failed: {e}")
+
+
+traffic_meter = TrafficMeter()
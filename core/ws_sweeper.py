@@ -0,0 +1,60 @@
+import asyncio
+from typing import Optional
+
+from .utils import logger, clock
+from .utils.metrics import metrics
+from data.config import WS_STALE_AFTER, WS_SWEEP_INTERVAL
+
+
+class WsSweeper:
+    # one loop checks the last frame watermark of every connection instead of a watchdog per connection.
+    # A stale websocket is closed, its pending receive returns and the connection fails over
+
+    def __init__(self, stale_after: float = WS_STALE_AFTER, interval: float = WS_SWEEP_INTERVAL):
+        self.stale_after = stale_after
+        self.interval = interval
+
+        self.clients = set()
+        self.closing = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def register(self, client):
+        self.clients.add(client)
+
+    def unregister(self, client):
+        self.clients.discard(client)
+
+    async def run(self):
+        while True:
+            await clock.sleep(self.interval)
+            self.sweep()
+
+    def sweep(self) -> int:
+        now = clock.monotonic()
+        stale = [client for client in self.clients
+                 if client.websocket is not None and not client.websocket.closed
+                 and now - client.last_live_timestamp > self.stale_after]
+
+        for client in stale:
+            logger.warning(f"{client.id} | No frames for {int(now - client.last_live_timestamp)}s, "
+                           f"closing stale websocket")
+            close = asyncio.create_task(client.websocket.close())
+            self.closing.add(close)
+            close.add_done_callback(self.closing.discard)
+
+        if stale:
+            metrics.incr("ws_swept", len(stale))
+            logger.info(f"Swept {len(stale)} stale websockets, {metrics.counters['ws_zombies']} "
+                        f"zombie connections caught so far")
+
+        return len(stale)
+
+
+ws_sweeper = WsSweeper()
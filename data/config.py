@@ -1,26 +1,117 @@
-THREADS = 5  # for claim rewards mode / approve email mode
+THREADS = 5  # for approve email mode
 MIN_PROXY_SCORE = 50  # Put MIN_PROXY_SCORE = 0 not to check proxy score (if site is down)
+PROXY_SCORE_CACHE_TTL = 6 * 60 * 60  # seconds to trust a known proxy score and skip probing it again (0 - disabled)
 
 NODE_TYPE = "1_25x"  # 1x, 1_25x, 2x
 
 # WebSocket configuration
 USE_WSS = False  # True для WSS (защищенное соединение), False для WS
+WS_COMPRESSION = True  # negotiate permessage-deflate with the server
+WS_COMPRESSION_SAMPLE_EVERY = 20  # every Nth sent frame is measured to estimate bytes saved for the metrics
+WS_RECEIVE_TIMEOUT = 30  # seconds to wait for the server answer to a PING before the connection is failed over (0 - no limit)
+WS_HEARTBEAT = 30  # seconds between websocket ping frames, a pong missing for half of it fails the connection over (0 - disabled)
+WS_STALE_AFTER = 5 * 60  # seconds without any frame from the server before the sweeper tears a connection down
+WS_SWEEP_INTERVAL = 10  # seconds between sweeps of stale connections
+
+# HTTP_REQUEST jobs: concurrency per proxy grows by one per window of fast answers and halves on an error or slow one
+JOB_CONCURRENCY_INITIAL = 2
+JOB_CONCURRENCY_MAX = 16
+JOB_LATENCY_TARGET = 10  # seconds, a slower answer counts as overload
+JOB_QUEUE_LIMIT = 32  # jobs waiting for a slot of one proxy, more are refused with 429 at once
+JOB_QUEUE_TIMEOUT = 20  # seconds a job waits for a slot before it's refused with 429
+JOB_TIMEOUT = 30  # seconds
+JOB_SESSIONS_LIMIT = 1000  # kept-alive sessions, one per proxy and target origin
+JOB_SESSION_CONNECTIONS = 4  # connections a session keeps to its target
+JOB_SESSION_IDLE_TTL = 90  # seconds an unused session keeps its connections open
+JOB_REPORT_INTERVAL = 5 * 60  # seconds between logs of the busiest proxies by queued jobs (0 - disabled)
 
 #########################################
 CLAIM_REWARDS_ONLY = False  # claim tiers rewards only (https://app.getgrass.io/dashboard/referral-program)
+CLAIM_CONCURRENCY = 50  # accounts claimed at the same time
+CLAIM_LOGIN_RATE = 2  # logins per second in claim mode
+CLAIM_TOKEN_TTL = 12 * 60 * 60  # seconds to reuse a cached access token instead of logging in (0 - always log in)
+CLAIM_PROGRESS_INTERVAL = 10  # seconds between claim progress lines
+CLAIM_CHECKPOINT_PATH = 'data/claim_checkpoint.txt'  # emails already claimed, skipped by the next run (delete to reclaim)
 
 STOP_ACCOUNTS_WHEN_SITE_IS_DOWN = True  # stop account for 20 minutes, to reduce proxy traffic usage
-CHECK_POINTS = True  # show point for each account every nearly 10 minutes
+CIRCUIT_BREAKER_FAILURES = 5  # consecutive failures that open the circuit of an upstream host or a proxy
+CIRCUIT_BREAKER_RECOVERY = 10 * 60  # seconds an open circuit waits before letting a single probe through
+
+# Retry backoff per error class: delay = min(cap, base * 2 ** (attempt - 1)) reduced by a random share up to jitter,
+# budget - max attempts (None - unlimited)
+BACKOFF_POLICIES = {
+    "login": {"base": 8, "cap": 60, "jitter": 0.5, "budget": 12},
+    "retrieve_user": {"base": 1, "cap": 5, "jitter": 0.5, "budget": 3},
+    "points": {"base": 5, "cap": 30, "jitter": 0.5, "budget": 3},
+    "claim": {"base": 5, "cap": 30, "jitter": 0.5, "budget": 3},
+    "proxy_score": {"base": 1, "cap": 10, "jitter": 0.5, "budget": 3},
+    "ws_connect": {"base": 7, "cap": 30, "jitter": 0.3, "budget": 7},
+    "reconnect": {"base": 20, "cap": 5 * 60, "jitter": 0.5, "budget": None},
+    "failure_limit": {"base": 60, "cap": 15 * 60, "jitter": 0.5, "budget": None},
+    "no_proxies": {"base": 30 * 60, "cap": 60 * 60, "jitter": 0.2, "budget": None},
+}
+CHECK_POINTS = True  # show points of each account, polled once per POINTS_POLL_INTERVAL
+POINTS_POLL_INTERVAL = 30 * 60  # seconds between points checks of one account, checks of all accounts are spread evenly
+POINTS_FLUSH_INTERVAL = 60  # seconds between batched writes of polled points to the DB
+POINTS_ROLLUP_INTERVAL = 60 * 60  # seconds between hourly/daily points rollups (0 - disabled)
+POINTS_HISTORY_RETENTION_DAYS = 7  # raw points history is pruned after this many days
+POINTS_HOURLY_RETENTION_DAYS = 30  # hourly rollups are pruned after this many days, daily ones are kept
+TRAFFIC_FLUSH_INTERVAL = 5 * 60  # seconds between writes of per-proxy traffic counters to the DB (0 - disabled)
 SHOW_LOGS_RARELY = False  # not always show info about actions to decrease pc influence
+LOG_GUI_MAX_LINES = 5000  # lines kept in the GUI log window, older ones are dropped
+LOG_GUI_BUFFER_SIZE = 10000  # lines waiting for the GUI log window, the oldest are skipped when it can't keep up
+LOG_GUI_FLUSH_INTERVAL = 200  # ms between renders of buffered lines in the GUI log window
+METRICS_LOG_INTERVAL = 10 * 60  # seconds between metrics summaries in logs (0 - disabled)
+
+# Runtime profiling: `kill -USR1 <pid>` samples the event loop, `kill -USR2 <pid>` twice dumps top allocations
+PROFILER_PORT = 0  # localhost port for `curl -X POST 127.0.0.1:PORT/profile?seconds=30` and `/memory` (0 - disabled)
+PROFILER_DIR = 'logs/profiles'
+PROFILE_DURATION = 30  # seconds
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds of CPU time between stack samples
+PROFILER_MEMORY_TOP = 25  # modules and lines in an allocations snapshot
+PROFILER_MEMORY_FRAMES = 10  # traceback depth kept by tracemalloc to find the farm code behind an allocation
+
+# Startup probing: RTT to director/api through every proxy, the fastest healthy ones become primaries
+PROBE_PROXIES_ON_START = True
+PROXY_PROBE_CONCURRENCY = 50
+PROXY_PROBE_TIMEOUT = 10  # seconds
+PROXY_PROBE_MAX_AGE = 24 * 60 * 60  # seconds to reuse measurements stored by previous runs
+
+# Warm standby: each account keeps a validated next proxy with a ready check-in for instant failover
+WARM_STANDBY = False
+WARM_STANDBY_CHECKIN_TTL = 5 * 60  # seconds a prefetched check-in (destination/token) is considered fresh
+
+# Spare proxies allocation: when spares run low they go to the accounts earning the most per proxy
+ALLOCATOR_SCARCE_BELOW = 20  # spares left below which requests are served by yield (0 - first come first served)
+ALLOCATOR_WINDOW = 5  # seconds requests for scarce spares are gathered before being ranked
+ALLOCATOR_BURN_WINDOW = 6 * 60 * 60  # seconds a granted spare lowers the account priority
+ALLOCATOR_RATES_TTL = 10 * 60  # seconds between reloads of points/hour per account
 
 # Mining mode
 MINING_MODE = True
+MULTI_CONNECTION_MODE = False  # duplicated accounts share one login, session and points poller, spread over their proxies
+RAMP_START_RATE = 0.7  # accounts started per second on a regular start
+RAMP_MAX_RATE = 10  # accounts started per second on a --resume start
+SHUTDOWN_TIMEOUT = 15  # seconds to close connections on Ctrl-C/SIGTERM before giving up
+HOT_RELOAD_INTERVAL = 30  # seconds between checks of accounts/proxies files for changes while mining (0 - disabled)
+
+# Multi-node farm: `python -m core.coordinator` leases accounts and spare proxies to `python main.py --node URL`
+COORDINATOR_HOST = '127.0.0.1'
+COORDINATOR_PORT = 8765
+COORDINATOR_DB_PATH = 'data/coordinator.db'
+COORDINATOR_TOKEN = ''  # shared secret sent by nodes, leases carry account passwords (empty - no check)
+LEASE_TTL = 90  # seconds a lease lives without a heartbeat, then the account moves to another node
+NODE_HEARTBEAT_INTERVAL = 30  # seconds between node heartbeats renewing its leases
+NODE_CAPACITY = 0  # accounts a node leases at most (0 - as many as are free)
+NODE_SPARE_PROXIES = 10  # spare proxies a node keeps leased for failover
 
 ########################################
 
 ACCOUNTS_FILE_PATH = 'data/accounts.txt'
 PROXIES_FILE_PATH = 'data/proxies.txt'
 PROXY_DB_PATH = 'data/proxies_stats.db'
+DB_READ_POOL_SIZE = 4  # read-only connections serving SELECTs concurrently with the single writer (0 - writer only)
+STATE_SNAPSHOT_PATH = 'data/state_snapshot.json'  # per-account state saved on shutdown, restored by `main.py --resume`
 
 #######################################
 # Очистка базы данных с плохими прокси
@@ -1,7 +1,10 @@
+import argparse
 import asyncio
 import ctypes
 import os
 import random
+import signal
+import socket
 import sys
 import traceback
 
@@ -12,17 +15,34 @@ from fake_useragent import UserAgent
 
 from better_proxy import Proxy
 
-from core import Grass
+from core import Grass, MultiGrass
 from core.autoreger import AutoReger
+from core.claim_pipeline import ClaimPipeline
+from core.farm_node import FarmNode
+from core.farm_reloader import FarmReloader, group_accounts
+from core.farm_state import farm_state
+from core.points_poller import points_poller
+from core.profiler import profiler
+from core.ws_sweeper import ws_sweeper
 from core.utils import logger, file_to_list
 from core.utils.accounts_db import AccountsDB
 from core.utils.exception import LoginException
-from data.config import ACCOUNTS_FILE_PATH, PROXIES_FILE_PATH, THREADS, \
+from core.utils.job_limiter import job_limiters
+from core.utils.job_sessions import job_sessions
+from core.utils.metrics import metrics
+from core.utils.proxy_probe import rank_proxies
+from core.utils.rate_limiter import RateLimiter
+from core.utils.session import close_shared_session
+from core.utils.traffic import traffic_meter
+from data.config import ACCOUNTS_FILE_PATH, PROXIES_FILE_PATH, \
     CLAIM_REWARDS_ONLY, MINING_MODE, \
     PROXY_DB_PATH, MIN_PROXY_SCORE, CHECK_POINTS, STOP_ACCOUNTS_WHEN_SITE_IS_DOWN, \
-    SHOW_LOGS_RARELY, NODE_TYPE
+    SHOW_LOGS_RARELY, NODE_TYPE, METRICS_LOG_INTERVAL, PROBE_PROXIES_ON_START, MULTI_CONNECTION_MODE, \
+    TRAFFIC_FLUSH_INTERVAL, HOT_RELOAD_INTERVAL, RAMP_START_RATE, RAMP_MAX_RATE, SHUTDOWN_TIMEOUT, \
+    STATE_SNAPSHOT_PATH, JOB_REPORT_INTERVAL
 
 ua = UserAgent(platforms=['desktop'])
+start_limiter = RateLimiter(RAMP_START_RATE)
 
 
 def bot_info(name: str = ""):
@@ -37,7 +57,7 @@ def bot_info(name: str = ""):
     )
 
 
-async def worker_task(_id, account: str, proxy: str = None, db: AccountsDB = None):
+async def worker_task(_id, account: str, proxy: str = None, db: AccountsDB = None, connections: int = 1):
     try:
         email, password = account.split(":")[:2]
     except ValueError:
@@ -49,26 +69,38 @@ async def worker_task(_id, account: str, proxy: str = None, db: AccountsDB = Non
     try:
         user_agent = str(ua.random)
 
-        grass = Grass(
-            _id=_id,
-            email=email,
-            password=password,
-            proxy=proxy,
-            db=db,
-            user_agent=user_agent
-        )
+        if connections > 1:
+            grass = MultiGrass(
+                _id=_id,
+                email=email,
+                password=password,
+                connections=connections,
+                proxy=proxy,
+                db=db,
+                user_agent=user_agent
+            )
+        else:
+            grass = Grass(
+                _id=_id,
+                email=email,
+                password=password,
+                proxy=proxy,
+                db=db,
+                user_agent=user_agent
+            )
+
+        farm_state.register(grass)
+        if state := farm_state.pop(email):
+            grass.restore(state)
 
         if MINING_MODE:
-            await asyncio.sleep(random.uniform(1, 2) * _id)
+            await start_limiter.acquire()
             logger.info(f"Starting №{_id} | {email} | {password} | {proxy}")
         else:
             await asyncio.sleep(random.uniform(1, 3))
             logger.info(f"Starting №{_id} | {email} | {password} | {proxy}")
 
-        if CLAIM_REWARDS_ONLY:
-            await grass.claim_rewards()
-        else:
-            await grass.start()
+        await grass.start()
 
         return True
     except LoginException as e:
@@ -79,27 +111,52 @@ async def worker_task(_id, account: str, proxy: str = None, db: AccountsDB = Non
         logger.error(f"{_id} | not handled exception | error: {e} {traceback.format_exc()}")
     finally:
         if grass:
-            await grass.session.close()
+            farm_state.unregister(grass)
+            await grass.close()
 
 
-async def main():
-    accounts = file_to_list(ACCOUNTS_FILE_PATH)
+async def multi_worker_task(_id, account: str, proxy: str = None, connections: int = 1, db: AccountsDB = None):
+    return await worker_task(_id, account, proxy, db, connections)
 
-    if not accounts:
-        logger.warning("No accounts found!")
-        return
 
-    proxies = [Proxy.from_str(proxy).as_url for proxy in file_to_list(PROXIES_FILE_PATH)]
+def install_shutdown_handlers(shutdown: asyncio.Event):
+    loop = asyncio.get_running_loop()
 
-    #### delete DB if it exists to clean up
-    try:
-        if os.path.exists(PROXY_DB_PATH):
-            os.remove(PROXY_DB_PATH)
-    except PermissionError:
-        logger.warning(f"Cannot remove {PROXY_DB_PATH}, file is in use")
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, shutdown.set)
+        except NotImplementedError:
+            # windows event loops have no signal handlers
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(shutdown.set))
+
+
+async def main(resume: bool = False, coordinator: str = None, node_id: str = None):
+    if coordinator:
+        if CLAIM_REWARDS_ONLY:
+            logger.warning("Node mode is for mining, claim rewards from local files")
+            return
+
+        # accounts and proxies come from the coordinator leases
+        accounts, proxies = [], []
+    else:
+        accounts = file_to_list(ACCOUNTS_FILE_PATH)
+
+        if not accounts:
+            logger.warning("No accounts found!")
+            return
+
+        proxies = [Proxy.from_str(proxy).as_url for proxy in file_to_list(PROXIES_FILE_PATH)]
 
     db = AccountsDB(PROXY_DB_PATH)
     await db.connect()
+    await db.reset_run_state()
+
+    if PROBE_PROXIES_ON_START and proxies:
+        proxies = await rank_proxies(proxies, db)
+
+    if resume and farm_state.load(STATE_SNAPSHOT_PATH):
+        proxies = farm_state.arrange_proxies(accounts, proxies)
+        start_limiter.rate = RAMP_MAX_RATE
 
     for i, account in enumerate(accounts):
         email = account.split(":")[0]
@@ -113,34 +170,116 @@ async def main():
     await db.delete_all_from_extra_proxies()
     await db.push_extra_proxies(proxies[len(accounts):])
 
-    autoreger = AutoReger.get_accounts(
-        (ACCOUNTS_FILE_PATH, PROXIES_FILE_PATH),
-        with_id=True,
-        static_extra=(db,)
-    )
-
-    threads = THREADS
-
     if CLAIM_REWARDS_ONLY:
-        msg = "__CLAIM__ MODE"
-    else:
-        msg = "__MINING__ MODE"
-        threads = len(autoreger.accounts)
-
-    logger.info(msg)
+        logger.info("__CLAIM__ MODE")
+        await ClaimPipeline(accounts, proxies, db).run()
+        await traffic_meter.flush(db)
+        await db.close_connection()
+        return
 
-    await autoreger.start(worker_task, threads)
+    worker = worker_task
+
+    if coordinator:
+        autoreger = AutoReger([], persistent=True)
+        if MULTI_CONNECTION_MODE:
+            worker = multi_worker_task
+    elif MULTI_CONNECTION_MODE:
+        # duplicated lines of one email become connections of a single account
+        grouped = [(account, proxies[i] if len(proxies) > i else None, connections)
+                   for account, i, connections in group_accounts(accounts, multi=True).values()]
+
+        autoreger = AutoReger.from_lists(
+            tuple(zip(*grouped)),
+            with_id=True,
+            static_extra=(db,)
+        )
+        worker = multi_worker_task
+    else:
+        autoreger = AutoReger.from_lists(
+            (accounts, proxies),
+            with_id=True,
+            static_extra=(db,)
+        )
 
+    logger.info("__MINING__ MODE")
+
+    metrics_task = asyncio.create_task(metrics.log_periodically(METRICS_LOG_INTERVAL)) if METRICS_LOG_INTERVAL else None
+
+    traffic_task = asyncio.create_task(
+        traffic_meter.flush_periodically(db, TRAFFIC_FLUSH_INTERVAL)) if TRAFFIC_FLUSH_INTERVAL else None
+
+    job_report_task = asyncio.create_task(
+        job_limiters.log_periodically(JOB_REPORT_INTERVAL)) if JOB_REPORT_INTERVAL else None
+
+    if CHECK_POINTS:
+        points_poller.start(db)
+    ws_sweeper.start()
+    await profiler.start()
+
+    reloader = None
+    if coordinator:
+        reloader = FarmNode(autoreger, db, coordinator, node_id or f"{socket.gethostname()}-{os.getpid()}",
+                            multi=MULTI_CONNECTION_MODE)
+        reloader.start()
+    elif HOT_RELOAD_INTERVAL:
+        reloader = FarmReloader(autoreger, db, accounts, proxies,
+                                multi=MULTI_CONNECTION_MODE, interval=HOT_RELOAD_INTERVAL)
+        reloader.start()
+
+    shutdown = asyncio.Event()
+    install_shutdown_handlers(shutdown)
+
+    farm_task = asyncio.create_task(autoreger.start(worker, len(autoreger.accounts)))
+    shutdown_task = asyncio.create_task(shutdown.wait())
+    await asyncio.wait([farm_task, shutdown_task], return_when=asyncio.FIRST_COMPLETED)
+    shutdown_task.cancel()
+
+    if reloader:
+        reloader.stop()
+
+    if shutdown.is_set():
+        logger.info("Shutting down...")
+        farm_state.save(STATE_SNAPSHOT_PATH)
+
+        if pending := await autoreger.stop(SHUTDOWN_TIMEOUT):
+            logger.warning(f"{pending} accounts didn't close in {SHUTDOWN_TIMEOUT} seconds")
+        farm_task.cancel()
+
+    if coordinator:
+        await reloader.release()
+
+    await points_poller.stop()
+    ws_sweeper.stop()
+    await profiler.stop()
+    if traffic_task:
+        traffic_task.cancel()
+    await traffic_meter.flush(db)
+    if job_report_task:
+        job_report_task.cancel()
+    if metrics_task:
+        metrics_task.cancel()
+
+    await job_sessions.close()
+    await close_shared_session()
     await db.close_connection()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true",
+                        help=f"restore accounts state saved on the last shutdown ({STATE_SNAPSHOT_PATH})")
+    parser.add_argument("--node", metavar="URL",
+                        help="run as a farm node leasing accounts and proxies from a coordinator "
+                             "(python -m core.coordinator)")
+    parser.add_argument("--node-id", help="name of this node at the coordinator (default: host-pid)")
+    args = parser.parse_args()
+
     if sys.platform == 'win32':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
         bot_info("GRASS 5.1.1")
         loop = asyncio.ProactorEventLoop()
         asyncio.set_event_loop(loop)
-        loop.run_until_complete(main())
+        loop.run_until_complete(main(args.resume, args.node, args.node_id))
     else:
         bot_info("GRASS 5.1.1")
-        asyncio.run(main())
\ No newline at end of file
+        asyncio.run(main(args.resume, args.node, args.node_id))
\ No newline at end of file